@@ -0,0 +1,205 @@
+"""无界面的批量视频风格化命令行
+
+示例：
+    python -m batch_cli "videos/*.mp4" --style 素描风格 --strength 60 -o out/ --jobs 2
+    python -m batch_cli --manifest jobs.txt --style 油画风格 -o out/
+    python -m batch_cli "videos/*.mp4" --style-preset 柔和水彩 -o out/
+
+清单文件每行一个输入路径，或一个 JSON 对象：
+    {"input": "a.mp4", "style": "水彩风格", "params": {"strength": 80}, "output": "out/a.mp4"}
+    {"input": "b.mp4", "preset": "柔和水彩"}
+以 # 开头的行会被忽略。本模块只依赖处理核心，不会导入 PySide6。
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from frame_pipeline import EXECUTION_MODES
+from presets import PresetStore
+from result_cache import open_result_cache
+from style_engines import available_styles
+from stylizer import DEFAULT_OPTIONS, VideoStylizer
+
+
+def expand_inputs(patterns):
+    """展开通配符，保持顺序并去重"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def read_manifest(manifest_path):
+    """读取任务清单，返回 dict 列表，每项至少包含 input"""
+    entries = []
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                if 'input' not in entry:
+                    raise ValueError(f"清单条目缺少 input 字段: {line}")
+                entries.append(entry)
+            else:
+                entries.extend({'input': path} for path in expand_inputs([line]))
+    return entries
+
+
+DEFAULT_STYLE = '油画风格'
+DEFAULT_PARAMS = {'strength': 50, 'saturation': 0, 'brightness': 0, 'scale_factor': 1.0}
+
+
+def build_jobs(args):
+    """把命令行参数和清单合并为任务列表
+
+    风格和参数的优先级：清单条目 > 命令行显式给出的值 > 预设（清单条目的 preset
+    或 --style-preset）> 默认值。不同目录中的同名输入会得到相同的默认输出路径，
+    并行处理时互相覆盖，因此输出路径重复时抛出 ValueError。
+    """
+    cli_params = {name: value for name, value in (('strength', args.strength),
+                                                  ('saturation', args.saturation),
+                                                  ('brightness', args.brightness),
+                                                  ('scale_factor', args.scale))
+                  if value is not None}
+    entries = [{'input': path} for path in expand_inputs(args.inputs)]
+    if args.manifest:
+        entries.extend(read_manifest(args.manifest))
+
+    store = PresetStore(args.presets_file)
+    jobs = []
+    for entry in entries:
+        stem = os.path.splitext(os.path.basename(entry['input']))[0]
+        output = entry.get('output') or os.path.join(args.output_dir, f'{stem}{args.suffix}.mp4')
+        style, params = DEFAULT_STYLE, dict(DEFAULT_PARAMS)
+        preset_name = entry.get('preset', args.style_preset)
+        if preset_name:
+            preset = store.get(preset_name)
+            style = preset['style']
+            params.update(preset['params'])
+        jobs.append({
+            'input': entry['input'],
+            'style': entry.get('style') or args.style or style,
+            'params': {**params, **cli_params, **entry.get('params', {})},
+            'output': output,
+        })
+
+    outputs = {}
+    for job in jobs:
+        key = os.path.normcase(os.path.abspath(job['output']))
+        if key in outputs:
+            raise ValueError(f"{outputs[key]} 和 {job['input']} 的输出路径相同: {job['output']}，"
+                             f"请在清单中为其指定 output")
+        outputs[key] = job['input']
+    return jobs
+
+
+def run_job(job, options, metrics_format=None):
+    """处理单个任务，返回耗时（秒）；metrics_format 为 'json' / 'prom' 时在输出旁写出指标文件"""
+    os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+    start = time.perf_counter()
+    if metrics_format:
+        options = dict(options, metrics=True, metrics_path=f"{job['output']}.metrics.{metrics_format}")
+    stylizer = VideoStylizer(job['input'], job['style'], job['params'], options)
+    stylizer.process_video(job['output'])
+    return time.perf_counter() - start
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m batch_cli', description='批量视频风格化（无界面）')
+    parser.add_argument('inputs', nargs='*', help='输入视频路径或通配符')
+    parser.add_argument('--manifest', help='任务清单文件')
+    parser.add_argument('-o', '--output-dir', default='.', help='输出目录')
+    parser.add_argument('--suffix', default='_styled', help='输出文件名后缀')
+    parser.add_argument('--style', choices=available_styles(), help=f'风格名称，默认为 {DEFAULT_STYLE}')
+    parser.add_argument('--style-preset', help='参数预设名称（在界面中保存），载入其中的风格和参数')
+    parser.add_argument('--presets-file', default='presets.json', help='参数预设文件')
+    parser.add_argument('--strength', type=int, help='效果强度 0-100，默认 50')
+    parser.add_argument('--saturation', type=int, help='饱和度 -100 到 100，默认 0')
+    parser.add_argument('--brightness', type=int, help='亮度 -100 到 100，默认 0')
+    parser.add_argument('--scale', type=float, help='输出尺寸缩放 0.25-1.0，默认 1.0')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='同时处理的文件数')
+    parser.add_argument('--workers', type=int, help='每个任务的帧处理线程/进程数，默认按 CPU 核数平分')
+    parser.add_argument('--execution-mode', choices=EXECUTION_MODES, default=DEFAULT_OPTIONS['execution_mode'])
+    parser.add_argument('--decoder', choices=('auto', 'ffmpeg', 'opencv'), default=DEFAULT_OPTIONS['decoder'])
+    parser.add_argument('--encoder', choices=('auto', 'ffmpeg', 'opencv'), default=DEFAULT_OPTIONS['encoder'])
+    parser.add_argument('--preset', default=DEFAULT_OPTIONS['preset'], help='libx264 编码预设')
+    parser.add_argument('--crf', type=int, default=DEFAULT_OPTIONS['crf'], help='libx264 质量')
+    parser.add_argument('--chunks', type=int, default=DEFAULT_OPTIONS['chunks'],
+                        help='按关键帧分块并行处理的块数（需要 ffmpeg 和 ffprobe）')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_OPTIONS['tile_size'],
+                        help='大帧分块风格化的块边长（像素），用于 4K/8K 素材；0 为关闭')
+    parser.add_argument('--temporal-threshold', type=float, default=DEFAULT_OPTIONS['temporal_threshold'],
+                        help='时域跳帧阈值（区块灰度差 0-255），画面几乎不变的帧复用上一帧结果；0 为关闭')
+    parser.add_argument('--cache-dir', help='结果缓存目录，相同源文件、风格和参数的任务直接复用之前的输出')
+    parser.add_argument('--cache-max-gb', type=float,
+                        default=DEFAULT_OPTIONS['cache_max_bytes'] / 1024 ** 3, help='结果缓存容量上限（GB）')
+    parser.add_argument('--metrics', choices=('json', 'prom'),
+                        help='为每个任务在输出文件旁写出各阶段耗时指标（JSON 或 Prometheus 文本格式）')
+    parser.add_argument('--skip-existing', action='store_true', help='跳过输出文件已存在的任务')
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.manifest:
+        parser.error('需要至少一个输入文件或 --manifest')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        jobs = build_jobs(args)
+    except (OSError, ValueError) as e:
+        print(f"无法创建任务: {e}", file=sys.stderr)
+        return 2
+    if args.skip_existing:
+        jobs = [job for job in jobs if not os.path.exists(job['output'])]
+    if not jobs:
+        print('没有需要处理的文件')
+        return 0
+
+    job_parallelism = max(1, min(args.jobs, len(jobs)))
+    # 任务级并行与帧级并行共用 CPU，默认平分核数避免过度订阅
+    workers = args.workers or max(1, multiprocessing.cpu_count() // job_parallelism)
+    options = {
+        'execution_mode': args.execution_mode,
+        'num_workers': workers,
+        'decoder': args.decoder,
+        'encoder': args.encoder,
+        'preset': args.preset,
+        'crf': args.crf,
+        'chunks': args.chunks,
+        'tile_size': args.tile_size,
+        'temporal_threshold': args.temporal_threshold,
+        'cache_dir': args.cache_dir,
+        'cache_max_bytes': int(args.cache_max_gb * 1024 ** 3),
+    }
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=job_parallelism) as executor:
+        futures = {executor.submit(run_job, job, options, args.metrics): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                elapsed = future.result()
+                print(f"[完成] {job['input']} -> {job['output']} ({elapsed:.1f}s)")
+            except Exception as e:
+                failures += 1
+                print(f"[失败] {job['input']}: {e}", file=sys.stderr)
+    print(f'共 {len(jobs)} 个任务，成功 {len(jobs) - failures}，失败 {failures}')
+    if args.cache_dir:
+        stats = open_result_cache(args.cache_dir, options['cache_max_bytes']).stats()
+        print(f"结果缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+              f"{stats['entries']} 项 / {stats['bytes'] / 1024 ** 2:.1f} MB")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,371 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from frame_ops import FrameProcessor
+from frame_pipeline import EXECUTION_MODES, FramePipeline
+from style_engines import (available_styles, bilateral_cartoon, cartoon_kernel_size, compile_style,
+                           finish_sketch, sketch_gray)
+from stylizer import VideoStylizer
+
+STYLES = available_styles()
+
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+# 有独立参考实现的风格：引擎输出与参考实现比较 PSNR
+REFERENCES = {
+    '卡通/动漫风格': lambda frame, strength: bilateral_cartoon(frame, cartoon_kernel_size(strength)),
+    '素描风格': lambda frame, strength: finish_sketch(frame, sketch_gray(frame, strength), strength),
+}
+
+DEFAULT_PARAMS = {
+    'strength': 50,
+    'saturation': 0,
+    'brightness': 0,
+    'scale_factor': 1.0
+}
+
+
+def make_frames(width, height, count=8, seed=0):
+    """生成带渐变和噪声的合成帧，避免纯色帧让滤镜走捷径"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frames = []
+    for i in range(count):
+        base = np.stack([(x + y) / 2, np.roll(x, i * 7) + 0 * y, 255 - y + 0 * x], axis=2)
+        noise = rng.normal(0, 20, (height, width, 3))
+        frames.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def clip_frames(width, height, count=4):
+    """解码 make_test_clip 生成的 testsrc2 片段中的若干帧
+
+    测试图带文字、细线和锐利的色块边缘，经过一次 H.264 编码，比 make_frames 的
+    渐变加噪声更接近真实内容；保真度检查用这些帧，缩小处理在边缘处的损失不会被掩盖。
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = make_test_clip(os.path.join(work_dir, 'frames.mp4'), width, height, 1, fps=count,
+                              with_audio=False)
+        cap = cv2.VideoCapture(path)
+        frames = []
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+def run_pipeline(style, mode, frames, num_frames, num_workers, params=None):
+    """用合成帧跑一遍流水线，返回整体 fps 和各阶段统计"""
+    processor = FrameProcessor(style, dict(DEFAULT_PARAMS, **(params or {})))
+    pipeline = FramePipeline(processor, num_workers, mode=mode)
+    state = {'index': 0}
+
+    def read_frame():
+        if state['index'] >= num_frames:
+            return None
+        frame = frames[state['index'] % len(frames)]
+        state['index'] += 1
+        return frame
+
+    pipeline.run(read_frame, lambda frame: None)
+    return {
+        'fps': pipeline.overall_fps,
+        'stages': {name: stage.as_dict() for name, stage in pipeline.stats.items()},
+    }
+
+
+def compare_modes(styles, modes, width, height, num_frames, num_workers):
+    """对每种风格比较各执行模式的 fps"""
+    frames = make_frames(width, height)
+    results = {}
+    for style in styles:
+        results[style] = {}
+        for mode in modes:
+            result = run_pipeline(style, mode, frames, num_frames, num_workers)
+            results[style][mode] = result
+            print(f"{style:<10} {mode:<8} {result['fps']:8.1f} fps")
+    return results
+
+
+def psnr(reference, result):
+    """峰值信噪比（dB），两帧完全相同时返回 inf"""
+    mse = np.mean((reference.astype(np.float32) - result.astype(np.float32)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def measure_fps(func, frames, repeat=3):
+    """单线程逐帧调用 func 的吞吐，先预热一帧让引擎分配好缓冲区"""
+    func(frames[0])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            func(frame)
+    elapsed = time.perf_counter() - start
+    return repeat * len(frames) / elapsed if elapsed > 0 else 0.0
+
+
+def compare_engines(styles, width, height, strengths=(0, 50, 100), min_psnr=38.0):
+    """比较风格引擎与参考实现的单帧吞吐，并检查输出的 PSNR 是否达标（testsrc2 测试帧）"""
+    frames = clip_frames(width, height, count=4)
+    results = {}
+    for style in styles:
+        for strength in strengths:
+            params = dict(DEFAULT_PARAMS, strength=strength)
+            engine = compile_style(style, params)
+            reference = functools.partial(REFERENCES[style], strength=strength / 100.0)
+            lowest = min(psnr(reference(frame), engine(frame)) for frame in frames)
+            result = {
+                'reference_fps': measure_fps(reference, frames),
+                'engine_fps': measure_fps(engine, frames),
+                'psnr': lowest,
+                'passed': lowest >= min_psnr,
+            }
+            results[f'{style}@{strength}'] = result
+            print(f"{style:<10} 强度 {strength:>3}  参考实现 {result['reference_fps']:7.1f} fps  "
+                  f"引擎 {result['engine_fps']:7.1f} fps  PSNR {lowest:6.1f} dB"
+                  f"{'' if result['passed'] else '  低于阈值'}")
+    return results
+
+
+def latency_summary(latencies):
+    """逐帧延迟（秒）的分位数，单位毫秒"""
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000.0
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(values.max())}
+
+
+def run_case(style, mode, width, height, scale_factor, num_workers, num_frames):
+    """跑一个基准用例，返回 fps、逐帧延迟分位数、峰值内存和 CPU 利用率
+
+    逐帧延迟为一帧从读出到按顺序写出的时间，包含排队等待。峰值内存取本进程
+    与已回收子进程（进程模式的工作进程）中的最大值，因此每个用例应在独立的
+    进程中运行，见 run_isolated。
+    """
+    frames = make_frames(width, height, count=4)
+    processor = FrameProcessor(style, dict(DEFAULT_PARAMS, scale_factor=scale_factor))
+    pipeline = FramePipeline(processor, num_workers, mode=mode)
+    read_times = []
+    latencies = []
+
+    def read_frame():
+        if len(read_times) >= num_frames:
+            return None
+        read_times.append(time.perf_counter())
+        return frames[len(read_times) % len(frames)]
+
+    def write_frame(frame):
+        latencies.append(time.perf_counter() - read_times[len(latencies)])
+
+    before = (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    start = time.perf_counter()
+    pipeline.run(read_frame, write_frame)
+    wall = time.perf_counter() - start
+    after = (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+
+    cpu_time = sum(a.ru_utime + a.ru_stime - b.ru_utime - b.ru_stime for a, b in zip(after, before))
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'frames': len(latencies),
+        'wall_time': wall,
+        'fps': len(latencies) / wall if wall > 0 else 0.0,
+        'latency_ms': latency_summary(latencies),
+        'process_fps': pipeline.stats['process'].fps,
+        'peak_rss_mb': max(usage.ru_maxrss for usage in after) * rss_unit / 1024 ** 2,
+        'cpu_utilization': cpu_time / wall / multiprocessing.cpu_count() if wall > 0 else 0.0,
+    }
+
+
+def _run_case_worker(results, kwargs):
+    try:
+        results.put(run_case(**kwargs))
+    except Exception as e:
+        results.put({'error': str(e)})
+
+
+def run_isolated(**kwargs):
+    """在新启动的子进程中运行 run_case，使各用例的峰值内存互不影响"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_case_worker, args=(results, kwargs))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def environment_info():
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'cpu_count': multiprocessing.cpu_count(),
+    }
+
+
+def run_suite(styles, resolutions, scale_factors, worker_counts, mode, num_frames):
+    """风格 × 分辨率 × 缩放比例 × 工作线程数 的完整矩阵，不依赖 GPU 和界面"""
+    cases = {}
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for style in styles:
+            for scale_factor in scale_factors:
+                for num_workers in worker_counts:
+                    key = f'{style}|{resolution}|x{scale_factor:g}|{num_workers}w'
+                    result = run_isolated(style=style, mode=mode, width=width, height=height,
+                                          scale_factor=scale_factor, num_workers=num_workers,
+                                          num_frames=num_frames)
+                    cases[key] = result
+                    if 'error' in result:
+                        print(f"{key:<36} 失败: {result['error']}")
+                        continue
+                    print(f"{key:<36} {result['fps']:8.2f} fps  "
+                          f"p50 {result['latency_ms']['p50']:8.1f} ms  "
+                          f"p99 {result['latency_ms']['p99']:8.1f} ms  "
+                          f"内存 {result['peak_rss_mb']:7.1f} MB  "
+                          f"CPU {result['cpu_utilization'] * 100:5.1f}%")
+    return {'environment': environment_info(), 'mode': mode, 'frames': num_frames, 'cases': cases}
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1):
+    """与基线结果逐用例比较 fps 和 p90 延迟，返回超出容差的回归列表"""
+    regressions = []
+    for key, result in results['cases'].items():
+        base = baseline.get('cases', {}).get(key)
+        if base is None or 'error' in base or 'error' in result:
+            continue
+        fps_change = result['fps'] / base['fps'] - 1 if base['fps'] else 0.0
+        latency_change = (result['latency_ms']['p90'] / base['latency_ms']['p90'] - 1
+                          if base['latency_ms'].get('p90') else 0.0)
+        flags = []
+        if fps_change < -tolerance:
+            flags.append('fps')
+        if latency_change > tolerance:
+            flags.append('p90')
+        print(f"{key:<36} fps {fps_change * 100:+6.1f}%  p90 {latency_change * 100:+6.1f}%"
+              f"{'  回归' if flags else ''}")
+        if flags:
+            regressions.append({'case': key, 'metrics': flags,
+                                'fps_change': fps_change, 'p90_change': latency_change})
+    return regressions
+
+
+def make_test_clip(path, width, height, seconds, fps=30, with_audio=True):
+    """用 ffmpeg 的 lavfi 测试源生成带音频的合成视频"""
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+           '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={seconds}']
+    if with_audio:
+        cmd += ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}', '-c:a', 'aac']
+    cmd += ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def compare_encoders(style, width, height, seconds, num_workers, preset='medium',
+                     encoders=('opencv', 'ffmpeg')):
+    """比较 VideoWriter + 音频合并 与 ffmpeg 管道编码的端到端吞吐"""
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = make_test_clip(os.path.join(work_dir, 'source.mp4'), width, height, seconds)
+        for encoder in encoders:
+            output = os.path.join(work_dir, f'output_{encoder}.mp4')
+            processor = VideoStylizer(source, style, dict(DEFAULT_PARAMS),
+                                      options={'encoder': encoder, 'num_workers': num_workers,
+                                               'preset': preset})
+            start = time.perf_counter()
+            processor.process_video(output)
+            elapsed = time.perf_counter() - start
+            frames = processor.pipeline_stats['encode'].count
+            results[encoder] = {
+                'seconds': elapsed,
+                'fps': frames / elapsed if elapsed > 0 else 0.0,
+                'encode_busy_time': processor.pipeline_stats['encode'].busy_time,
+                'output_bytes': os.path.getsize(output),
+            }
+            print(f"{encoder:<8} {elapsed:8.2f}s {results[encoder]['fps']:8.1f} fps "
+                  f"{results[encoder]['output_bytes'] / 1e6:8.2f} MB")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='视频风格化处理性能测试')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--workers', type=int, default=max(1, multiprocessing.cpu_count() - 1))
+    parser.add_argument('--json', help='将结果写入 JSON 文件')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    modes_parser = subparsers.add_parser('modes', help='比较各执行模式的风格化 fps')
+    modes_parser.add_argument('--frames', type=int, default=60, help='每项测试处理的帧数')
+    modes_parser.add_argument('--styles', nargs='+', default=STYLES)
+    modes_parser.add_argument('--modes', nargs='+', default=list(EXECUTION_MODES), choices=EXECUTION_MODES)
+
+    encoders_parser = subparsers.add_parser('encoders', help='比较 OpenCV 与 ffmpeg 管道编码的吞吐')
+    encoders_parser.add_argument('--style', default='素描风格')
+    encoders_parser.add_argument('--seconds', type=int, default=10, help='合成测试视频的时长')
+    encoders_parser.add_argument('--preset', default='medium', help='ffmpeg 管道编码使用的 libx264 预设')
+
+    engines_parser = subparsers.add_parser('engines', help='风格引擎与参考实现的吞吐和保真度（PSNR）对比')
+    engines_parser.add_argument('--styles', nargs='+', default=list(REFERENCES), choices=list(REFERENCES))
+    engines_parser.add_argument('--min-psnr', type=float, default=38.0, help='PSNR 低于该值时返回非零退出码')
+
+    suite_parser = subparsers.add_parser('suite', help='各风格、分辨率、缩放比例和线程数的基准矩阵')
+    suite_parser.add_argument('--styles', nargs='+', default=STYLES, choices=STYLES)
+    suite_parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    suite_parser.add_argument('--scales', nargs='+', type=float, default=[1.0, 0.5], help='缩放比例')
+    suite_parser.add_argument('--worker-counts', nargs='+', type=int, help='工作线程数，默认 1 和 --workers')
+    suite_parser.add_argument('--mode', choices=EXECUTION_MODES, default='thread')
+    suite_parser.add_argument('--frames', type=int, default=20, help='每个用例处理的帧数')
+    suite_parser.add_argument('--baseline', help='基线结果 JSON，与之比较并在出现回归时返回非零退出码')
+    suite_parser.add_argument('--tolerance', type=float, default=0.1, help='允许的相对变化（默认 10%%）')
+    args = parser.parse_args(argv)
+
+    regressions = []
+    if args.command == 'suite':
+        worker_counts = args.worker_counts or sorted({1, args.workers})
+        results = run_suite(args.styles, args.resolutions, args.scales, worker_counts,
+                            args.mode, args.frames)
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+            results['regressions'] = regressions
+    elif args.command == 'modes':
+        results = compare_modes(args.styles, args.modes, args.width, args.height,
+                                args.frames, args.workers)
+    elif args.command == 'engines':
+        results = compare_engines(args.styles, args.width, args.height, min_psnr=args.min_psnr)
+    else:
+        results = compare_encoders(args.style, args.width, args.height, args.seconds, args.workers,
+                                   preset=args.preset)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.command == 'engines' and not all(result['passed'] for result in results.values()):
+        return 1
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
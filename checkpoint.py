@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import shutil
+
+# 会影响输出内容的处理选项，参与续传指纹和结果缓存键；decoder 取实际使用的解码器
+# （缩放在 ffmpeg 解码器内或 cv2 中完成，像素不同），见 VideoStylizer.output_options
+OUTPUT_OPTIONS = ('video_codec', 'preset', 'crf', 'tile_size', 'temporal_threshold', 'temporal_max_reuse',
+                  'decoder')
+
+
+def job_fingerprint(video_path, style, params, options):
+    """任务指纹：源文件大小和修改时间 + 风格 + 参数 + 编码和跳帧设置"""
+    stat = os.stat(video_path)
+    key = {
+        'source': os.path.abspath(video_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'style': style,
+        'params': params,
+        'encoding': {name: options.get(name) for name in OUTPUT_OPTIONS},
+    }
+    data = json.dumps(key, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，进程在写入过程中被终止也不会留下半个文件"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JobCheckpoint:
+    """任务工作目录：保存已编码完成的片段和 manifest.json
+
+    manifest 记录任务指纹、已提交的片段以及下一个待处理的帧号。
+    指纹不一致（源文件或参数变化）时丢弃旧的进度重新开始。
+    """
+
+    def __init__(self, work_dir, fingerprint):
+        self.work_dir = work_dir
+        self.fingerprint = fingerprint
+        self.manifest_path = os.path.join(work_dir, 'manifest.json')
+        self.manifest = self._load()
+
+    def _load(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('fingerprint') == self.fingerprint:
+                return manifest
+            print("任务参数已变化，丢弃之前的处理进度")
+            shutil.rmtree(self.work_dir)
+        os.makedirs(self.work_dir, exist_ok=True)
+        manifest = {'fingerprint': self.fingerprint, 'next_frame': 0, 'segments': []}
+        write_json_atomic(self.manifest_path, manifest)
+        return manifest
+
+    @property
+    def next_frame(self):
+        """下一个待处理的帧号，即已提交的帧数"""
+        return self.manifest['next_frame']
+
+    def segment_paths(self):
+        return [os.path.join(self.work_dir, s['file']) for s in self.manifest['segments']]
+
+    def next_segment_path(self):
+        return os.path.join(self.work_dir, f"segment_{len(self.manifest['segments']):05d}.mp4")
+
+    def commit_segment(self, path, frames):
+        """登记一个已完整写出的片段"""
+        self.manifest['segments'].append({
+            'file': os.path.basename(path),
+            'start_frame': self.manifest['next_frame'],
+            'frames': frames,
+        })
+        self.manifest['next_frame'] += frames
+        write_json_atomic(self.manifest_path, self.manifest)
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class SegmentedWriter:
+    """按固定帧数切分输出的写入器，每写满一个片段就提交到检查点
+
+    open_segment(path) 返回一个有 write/close/abort 的底层写入器（FFmpegWriter）。
+    """
+
+    def __init__(self, checkpoint, open_segment, segment_frames):
+        self.checkpoint = checkpoint
+        self.open_segment = open_segment
+        self.segment_frames = max(1, segment_frames)
+        self._writer = None
+        self._path = None
+        self._frames = 0
+
+    def write(self, frame):
+        if self._writer is None:
+            self._path = self.checkpoint.next_segment_path()
+            self._writer = self.open_segment(self._path + '.part.mp4')
+            self._frames = 0
+        self._writer.write(frame)
+        self._frames += 1
+        if self._frames >= self.segment_frames:
+            self.flush()
+
+    def flush(self):
+        """结束当前片段并提交"""
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._path + '.part.mp4', self._path)
+        self.checkpoint.commit_segment(self._path, self._frames)
+        self._writer = None
+
+    def close(self):
+        self.flush()
+
+    def abort(self):
+        """丢弃未完成的当前片段，已提交的片段保留用于续传"""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
@@ -0,0 +1,252 @@
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from checkpoint import OUTPUT_OPTIONS, job_fingerprint
+from ffmpeg_io import AudioDemuxer, FFmpegWriter, concat_segments, probe_keyframes, probe_video
+from frame_ops import FrameProcessor, compile_pipeline
+from frame_pipeline import FramePipeline, ProcessingCancelled
+from frame_pool import FramePool, queue_size_for_memory
+from frame_sources import FFmpegFrameSource
+from metrics import JobMetrics
+from progress import ProgressTracker
+from resolution import plan_resolution
+from result_cache import segment_key
+from temporal import make_skipper
+from tiling import TiledStyler
+
+
+def plan_chunks(keyframes, duration, num_chunks):
+    """按关键帧把视频切成最多 num_chunks 个时间段
+
+    每个分界点取离等分点最近的关键帧，保证各段都从关键帧开始解码、
+    拼接后不重不漏。返回 [(start, end)]，最后一段 end 为 None 表示到结尾。
+    """
+    boundaries = [0.0]
+    for i in range(1, num_chunks):
+        target = duration * i / num_chunks
+        candidates = [k for k in keyframes if boundaries[-1] < k < duration]
+        if not candidates:
+            break
+        boundary = min(candidates, key=lambda k: abs(k - target))
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    return list(zip(boundaries, boundaries[1:] + [None]))
+
+
+def chunk_path(work_dir, index):
+    return os.path.join(work_dir, f'chunk_{index:04d}.mp4')
+
+
+def render_chunk(video_path, info, start, end, output_path, style, params, use_gpu, options):
+    """在独立进程中处理一个时间段并编码为不含音频的片段，返回 (帧数, 跳过的帧数, 指标快照)
+
+    先写入 .part 文件，完成后再改名，中断或失败的片段不会被误认为已完成。
+    """
+    workers = options['chunk_frame_workers']
+    # 各时间段已经在独立进程中并行，画面分块只用于限制大帧的内存占用
+    style_fn = None
+    if options['tile_size']:
+        style_fn = TiledStyler(style, params, use_gpu, tile_size=options['tile_size'])
+    pool = FramePool()
+    # 风格化前的缩放在解码器内完成
+    plan = plan_resolution((info['width'], info['height']), params.get('scale_factor', 1.0),
+                           compile_pipeline(style, params, use_gpu).engine.upscale_after, decoder_scales=True)
+    processor = FrameProcessor(style, params, use_gpu, style_fn, stage_timing=options['metrics'],
+                               pool=pool, plan=plan)
+    input_shape = (plan.decode_size[1], plan.decode_size[0], 3)
+    queue_size = options['queue_size'] or queue_size_for_memory(
+        input_shape, processor.output_shape(input_shape), options['chunk_memory_limit'], workers)
+    pipeline = FramePipeline(processor, workers,
+                             mode='thread' if workers > 1 else 'serial',
+                             queue_size=queue_size, skipper=make_skipper(options), pool=pool)
+    metrics = JobMetrics()
+    metrics.attach(pipeline)
+    source = FFmpegFrameSource(video_path, pool=pool, info=info, start=start, end=end,
+                               size=plan.decoder_scale)
+    width, height = plan.output_size
+    part_path = output_path + '.part.mp4'
+    writer = FFmpegWriter(part_path, width, height, info['fps'],
+                          codec=options['video_codec'], preset=options['preset'],
+                          crf=options['crf'])
+    try:
+        frames = pipeline.run(source.read, writer.write)
+        with metrics.timed('encode_finish'):
+            writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        source.close()
+    os.replace(part_path, output_path)
+    skipped = pipeline.skipper.skipped if pipeline.skipper is not None else 0
+    return frames, skipped, metrics.snapshot()
+
+
+class ChunkedRenderer:
+    """分块并行渲染：按关键帧切分时间段，各段在独立进程中风格化并编码，
+    最后用 concat demuxer 无损拼接并一次性混入后台提取的音轨。
+
+    已完成的片段保存在工作目录中，失败的片段会自动重试；重新运行同一任务时
+    只处理尚未完成的片段。传入 cache 和 cache_key 时，每个片段按时间段存入
+    结果缓存，改变分块数后边界不变的片段也可以直接复用。传入 metrics 时合并各片段
+    子进程的指标，并记录拼接的耗时。每完成一个片段以 ProgressTracker 回调 on_eta。
+
+    output_options 为影响输出内容的选项（VideoStylizer.output_options），与源文件、
+    风格和参数一起构成任务指纹，决定工作目录中的片段能否复用；未传入时取自 options，
+    解码器记为 ffmpeg（分块总是用 ffmpeg 管道解码）。
+    """
+
+    def __init__(self, video_path, style, params, options, use_gpu=False,
+                 num_workers=1, on_progress=None, cache=None, cache_key=None, metrics=None,
+                 on_eta=None, output_options=None):
+        self.video_path = video_path
+        self.style = style
+        self.params = params
+        self.options = options
+        if output_options is None:
+            output_options = {name: options.get(name) for name in OUTPUT_OPTIONS}
+            output_options['decoder'] = 'ffmpeg'
+        self.output_options = output_options
+        self.use_gpu = use_gpu
+        self.num_workers = num_workers
+        self.on_progress = on_progress
+        self.cache = cache
+        self.cache_key = cache_key
+        self.metrics = metrics or JobMetrics()
+        self.on_eta = on_eta
+
+    def _prepare_work_dir(self, work_dir, chunks):
+        """工作目录中的片段只有在任务指纹和分块方式都一致时才复用，否则清空工作目录
+
+        任务指纹由源文件、风格、参数和 output_options 中的编码设置计算。
+        """
+        fingerprint = job_fingerprint(self.video_path, self.style, self.params, self.output_options)
+        plan = {'fingerprint': fingerprint, 'chunks': chunks}
+        plan_path = os.path.join(work_dir, 'plan.json')
+        if os.path.exists(plan_path):
+            with open(plan_path, 'r', encoding='utf-8') as f:
+                if json.load(f) == json.loads(json.dumps(plan)):
+                    return
+            print("任务参数已变化，丢弃之前的分块")
+            shutil.rmtree(work_dir)
+        else:
+            # 没有 plan.json 时无法判断残留片段属于哪个任务
+            for path in glob.glob(os.path.join(glob.escape(work_dir), 'chunk_*.mp4')):
+                os.remove(path)
+        os.makedirs(work_dir, exist_ok=True)
+        with open(plan_path, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, ensure_ascii=False)
+
+    def _chunk_cache_key(self, chunk):
+        return segment_key(self.cache_key, *chunk)
+
+    def _fetch_cached(self, chunks, work_dir, indices):
+        """从结果缓存取回片段，返回仍需渲染的片段序号"""
+        if self.cache is None:
+            return indices
+        return [i for i in indices
+                if not self.cache.fetch(self._chunk_cache_key(chunks[i]), chunk_path(work_dir, i),
+                                        link=True)]
+
+    def _report(self, progress):
+        if self.on_progress is not None:
+            self.on_progress(progress)
+
+    def render(self, output_path, work_dir=None, cancel_event=None):
+        info = probe_video(self.video_path)
+        keyframes = probe_keyframes(self.video_path, info['start_time'])
+        chunks = plan_chunks(keyframes, info['duration'], self.options['chunks'])
+        work_dir = work_dir or output_path + '.chunks'
+        self._prepare_work_dir(work_dir, chunks)
+        # 音轨在后台提取，与各分块的渲染同时进行
+        demuxer = AudioDemuxer(self.video_path, output_path, os.path.join(work_dir, 'audio.mka')).start()
+        try:
+            self._render_chunks(info, chunks, work_dir, cancel_event)
+        except Exception:
+            demuxer.cleanup()
+            raise
+
+        self._report(95)
+        with self.metrics.timed('audio_wait'):
+            audio_path = demuxer.wait()
+        self.metrics.stage('audio_extract').add(demuxer.elapsed)
+        with self.metrics.timed('concat'):
+            concat_segments([chunk_path(work_dir, i) for i in range(len(chunks))], output_path,
+                            os.path.join(work_dir, 'concat.txt'), audio_source=audio_path, audio_copy=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _render_chunks(self, info, chunks, work_dir, cancel_event):
+        """渲染工作目录中尚未完成的分块，失败的分块自动重试"""
+        parallelism = min(len(chunks), self.num_workers)
+        # 并行的各分块进程平分帧缓冲区的内存上限
+        options = dict(self.options,
+                       chunk_frame_workers=max(1, self.num_workers // parallelism),
+                       chunk_memory_limit=self.options['memory_limit'] // parallelism)
+        pending = [i for i in range(len(chunks)) if not os.path.exists(chunk_path(work_dir, i))]
+        missing = len(pending)
+        pending = self._fetch_cached(chunks, work_dir, pending)
+        done = len(chunks) - len(pending)
+        print(f"分块处理: 共 {len(chunks)} 段，已完成 {done} 段（其中缓存命中 {missing - len(pending)} 段），"
+              f"并行 {parallelism} 个进程")
+
+        # 按时长比例估计待渲染片段的总帧数，片段完成得不频繁，吞吐用较长的时间常数平滑
+        pending_duration = sum((chunks[i][1] if chunks[i][1] is not None else info['duration'])
+                               - chunks[i][0] for i in pending)
+        tracker = ProgressTracker(int(round(pending_duration * info['fps'])), tau=30.0, interval=0.0)
+        tracker.update(0)
+        rendered_frames = skipped_frames = 0
+        for attempt in range(self.options['chunk_retries'] + 1):
+            failed = []
+            with ProcessPoolExecutor(max_workers=parallelism) as executor:
+                # 同时提交的分块不超过并行进程数，取消时排队的分块还没有进入进程池
+                queued = list(pending)
+                futures = {}
+                cancelling = False
+                while queued or futures:
+                    while queued and len(futures) < parallelism and not cancelling:
+                        i = queued.pop(0)
+                        futures[executor.submit(render_chunk, self.video_path, info, *chunks[i],
+                                                chunk_path(work_dir, i), self.style, self.params,
+                                                self.use_gpu, options)] = i
+                    if not futures:
+                        break
+                    # 定时醒来检查取消请求，不必等到某个分块完成
+                    finished, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                    if not cancelling and cancel_event is not None and cancel_event.is_set():
+                        # 不再启动新的分块，正在运行的分块完成后保留在工作目录中
+                        cancelling = True
+                        for pending_future in futures:
+                            pending_future.cancel()
+                    for future in finished:
+                        index = futures.pop(future)
+                        if future.cancelled():
+                            continue
+                        try:
+                            frames, skipped, snapshot = future.result()
+                            rendered_frames += frames
+                            skipped_frames += skipped
+                            self.metrics.merge(snapshot)
+                            if self.cache is not None:
+                                self.cache.store(self._chunk_cache_key(chunks[index]),
+                                                 chunk_path(work_dir, index), link=True)
+                            done += 1
+                            self._report(int(done / len(chunks) * 90))
+                            tracker.update(rendered_frames)
+                            if self.on_eta is not None:
+                                self.on_eta(tracker)
+                        except Exception as e:
+                            print(f"分块 {index} 处理失败（第 {attempt + 1} 次）: {str(e)}")
+                            failed.append(index)
+            if cancel_event is not None and cancel_event.is_set():
+                raise ProcessingCancelled(f"分块处理已取消: {self.video_path}")
+            if not failed:
+                break
+            pending = sorted(failed)
+        else:
+            raise RuntimeError(f"分块 {pending} 多次重试后仍然失败，已完成的分块保留在 {work_dir}")
+
+        if skipped_frames:
+            print(f"时域跳帧: 跳过 {skipped_frames}/{rendered_frames} 帧")
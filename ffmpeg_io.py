@@ -0,0 +1,312 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+
+def ffmpeg_available():
+    """检查系统中是否安装了 ffmpeg"""
+    return shutil.which('ffmpeg') is not None
+
+
+class FFmpegWriter:
+    """通过 stdin 管道把原始 BGR 帧交给 ffmpeg 编码
+
+    指定 audio_source 时，同一个 ffmpeg 进程直接从源文件映射音频轨，
+    输出文件只写一次，不再需要临时视频/音频文件和二次合并。audio_copy 为 True 时
+    音频原样复制（见 audio_copy_compatible），否则转为 AAC。
+    """
+
+    def __init__(self, output_path, width, height, fps, audio_source=None,
+                 codec='libx264', preset='medium', crf=23, pix_fmt='yuv420p', audio_copy=False):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_source = audio_source
+        self.audio_copy = audio_copy
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.pix_fmt = pix_fmt
+        self.frames_written = 0
+        self.process = subprocess.Popen(self.build_command(), stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def build_command(self):
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+               '-s', f'{self.width}x{self.height}', '-r', str(self.fps),
+               '-i', 'pipe:0']
+        if self.audio_source:
+            # 音频轨可选，源视频没有音频时不会报错
+            cmd += ['-i', self.audio_source, '-map', '0:v:0', '-map', '1:a:0?',
+                    '-c:a', 'copy' if self.audio_copy else 'aac', '-shortest']
+        cmd += ['-c:v', self.codec]
+        if self.codec in ('libx264', 'libx265'):
+            cmd += ['-preset', self.preset, '-crf', str(self.crf)]
+        if self.pix_fmt == 'yuv420p' and (self.width % 2 or self.height % 2):
+            # yuv420p 要求宽高为偶数，奇数尺寸时补齐一个像素
+            cmd += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        cmd += ['-pix_fmt', self.pix_fmt, self.output_path]
+        return cmd
+
+    def write(self, frame):
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError(f"帧尺寸 {frame.shape[:2]} 与编码器尺寸 {(self.height, self.width)} 不一致")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg 编码进程已退出: {self._read_error()}")
+        self.frames_written += 1
+
+    def _read_error(self):
+        self.process.wait()
+        return self.process.stderr.read().decode('utf-8', errors='replace').strip()
+
+    def close(self):
+        """结束输入并等待编码完成"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 编码失败: {self._read_error()}")
+        self.process.stderr.close()
+
+    def abort(self):
+        """终止编码并删除未完成的输出文件"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stderr):
+            try:
+                stream.close()
+            except (BrokenPipeError, OSError):
+                pass
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def ffprobe_available():
+    """检查系统中是否安装了 ffprobe"""
+    return shutil.which('ffprobe') is not None
+
+
+def _parse_rate(rate):
+    """解析 ffprobe 的帧率字符串，如 '30000/1001'"""
+    if not rate or rate == '0/0':
+        return 0.0
+    if '/' in rate:
+        num, den = rate.split('/')
+        return float(num) / float(den) if float(den) else 0.0
+    return float(rate)
+
+
+def _require_ffprobe():
+    if not ffprobe_available():
+        raise RuntimeError("未找到 ffprobe，请安装 ffmpeg（包含 ffprobe）后重试")
+
+
+def count_frames(path):
+    """用 ffprobe 统计视频流的包数（只解复用不解码），即精确的帧数；失败时返回 0"""
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+           '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', path]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        return int(result.stdout.strip().split(',')[0] or 0)
+    except (subprocess.CalledProcessError, ValueError):
+        return 0
+
+
+def probe_video(path):
+    """用 ffprobe 读取视频的尺寸、帧率、帧数、时长和音频信息，不需要解码或 seek
+
+    容器记录了帧数（nb_frames）时直接使用；否则（MKV、部分 MOV/AVI 等）统计包数，
+    仍失败时才按时长和帧率估算，此时 frame_count_exact 为 False。
+    """
+    _require_ffprobe()
+    cmd = ['ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', path]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffprobe 读取视频信息失败: {e.stderr.decode('utf-8', errors='replace').strip()}")
+    data = json.loads(result.stdout)
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        raise RuntimeError(f"文件中没有视频流: {path}")
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    fps = _parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate'))
+    duration = float(video.get('duration') or data.get('format', {}).get('duration') or 0.0)
+    frame_count = int(video.get('nb_frames') or 0)
+    if frame_count <= 0:
+        frame_count = count_frames(path)
+    frame_count_exact = frame_count > 0
+    if not frame_count_exact:
+        # 统计失败时按时长和帧率估算（VFR 素材会有偏差）
+        frame_count = int(round(duration * fps))
+    return {
+        # -ss / -to 的时间以文件起始时间为零点
+        'start_time': float(data.get('format', {}).get('start_time') or 0.0),
+        'width': int(video['width']),
+        'height': int(video['height']),
+        'fps': fps,
+        'frame_count': frame_count,
+        'frame_count_exact': frame_count_exact,
+        'duration': duration,
+        'video_codec': video.get('codec_name'),
+        'audio_codec': audio.get('codec_name') if audio else None,
+    }
+
+
+def probe_keyframes(path, start_time=0.0):
+    """用 ffprobe 读取视频流所有关键帧的时间（秒，相对于文件起始时间 start_time），只读包头不解码"""
+    _require_ffprobe()
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffprobe 读取关键帧失败: {e.stderr.strip()}")
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.append(max(0.0, float(pts_time) - start_time))
+    keyframes.sort()
+    return keyframes
+
+
+def concat_segments(segment_paths, output_path, list_path, audio_source=None, audio_copy=False):
+    """用 concat demuxer 无损拼接视频片段，并从 audio_source 一次性混入音频
+
+    audio_source 为 AudioDemuxer 准备好的音轨时传入 audio_copy=True，拼接只写容器。
+    """
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_source:
+        cmd += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?',
+                '-c:a', 'copy' if audio_copy else 'aac', '-shortest']
+    cmd += ['-c:v', 'copy', output_path]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"拼接视频片段失败: {e.stderr.decode('utf-8', errors='replace').strip()}")
+
+
+# 各输出容器可以直接复制（不重新编码）的音频编码，None 表示任意编码；
+# 未列出的容器一律转为 AAC
+AUDIO_COPY_CODECS = {
+    '.mp4': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+    '.m4v': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+    '.mov': {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'pcm_s16le', 'pcm_s16be', 'pcm_s24le', 'pcm_s24be'},
+    '.mkv': None,
+}
+
+_AUDIO_STREAM_RE = re.compile(r'Stream #\d+:\d+.*?: Audio: (\w+)')
+
+
+def probe_audio_codec(path):
+    """返回第一条音频流的编码名（如 'aac'），没有音频时返回 None
+
+    有 ffprobe 时只读取流信息；否则解析 ffmpeg -i 打印的流列表。
+    """
+    if ffprobe_available():
+        cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+               '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', path]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        return result.stdout.strip().split(',')[0] or None
+    # 没有指定输出文件时 ffmpeg 以非零状态退出，流信息仍然打印在 stderr 中
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-nostdin', '-i', path],
+                            capture_output=True, text=True, errors='replace')
+    match = _AUDIO_STREAM_RE.search(result.stderr)
+    return match.group(1) if match else None
+
+
+def audio_copy_compatible(codec, output_path):
+    """codec 编码的音频能否不重新编码直接写入 output_path 的容器"""
+    allowed = AUDIO_COPY_CODECS.get(os.path.splitext(output_path)[1].lower(), set())
+    return codec is not None and (allowed is None or codec in allowed)
+
+
+class AudioDemuxer:
+    """在后台线程中把源文件的第一条音轨取出到单独的 Matroska 文件
+
+    任务开始时 start()，与视频处理同时进行。编码与输出容器兼容时原样复制，否则
+    转为 AAC，因此最后与视频混流时总是 -c copy，只需写容器；长的 4K 源文件中
+    音频包和大量视频数据交错存放，混流时也不必再把源文件读一遍。
+
+    wait() 等待完成并返回音轨路径，源文件没有音频或提取失败时返回 None；
+    elapsed 为提取耗时。先写 .part 文件再改名，被中断时不会留下不完整的音轨。
+    """
+
+    def __init__(self, source_path, output_path, audio_path):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.audio_path = audio_path
+        self.codec = None
+        self.copy = False
+        self.elapsed = 0.0
+        self._result = None
+        self._process = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.codec = probe_audio_codec(self.source_path)
+            if self.codec is None:
+                return
+            self.copy = audio_copy_compatible(self.codec, self.output_path)
+            part_path = self.audio_path + '.part'
+            cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-nostdin', '-i', self.source_path,
+                   '-map', '0:a:0', '-vn', '-sn', '-dn', '-c:a', 'copy' if self.copy else 'aac',
+                   '-f', 'matroska', part_path]
+            with self._lock:
+                if self._cancelled:
+                    return
+                self._process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            _, stderr = self._process.communicate()
+            if self._process.returncode != 0:
+                if not self._cancelled:
+                    print(f"音频提取失败: {stderr.decode('utf-8', errors='replace').strip()}")
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                return
+            os.replace(part_path, self.audio_path)
+            self._result = self.audio_path
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"音频提取失败: {str(e)}")
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+    def wait(self):
+        self._thread.join()
+        return self._result
+
+    def cleanup(self):
+        """终止未完成的提取并删除音轨文件"""
+        with self._lock:
+            self._cancelled = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.kill()
+        if self._thread.is_alive():
+            self._thread.join()
+        if os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
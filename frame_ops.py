@@ -0,0 +1,260 @@
+import functools
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from resolution import interpolation_for, plan_resolution, scaled_size
+from style_engines import compile_style
+
+
+def resize_to(frame, size, use_gpu=False, dst=None):
+    """把帧缩放到 size (宽, 高)，尺寸不变时直接返回原帧
+
+    缩小用 INTER_AREA，放大用 INTER_CUBIC；传入 dst 时写入该缓冲区（GPU 路径忽略 dst）。
+    """
+    height, width = frame.shape[:2]
+    if (width, height) == tuple(size):
+        return frame
+    interpolation = interpolation_for((width, height), size)
+    if use_gpu:
+        gpu_frame = cv2.cuda_GpuMat()
+        gpu_frame.upload(frame)
+        gpu_resized = cv2.cuda.resize(gpu_frame, tuple(size), interpolation=interpolation)
+        return gpu_resized.download()
+    else:
+        return cv2.resize(frame, tuple(size), dst=dst, interpolation=interpolation)
+
+
+def resize_frame(frame, scale_factor, use_gpu=False, dst=None):
+    """调整帧的大小，传入 dst 时写入该缓冲区（GPU 路径忽略 dst）"""
+    if scale_factor == 1.0:
+        return frame
+    return resize_to(frame, scaled_size((frame.shape[1], frame.shape[0]), scale_factor), use_gpu, dst)
+
+
+@functools.lru_cache(maxsize=32)
+def build_adjust_lut(saturation, brightness):
+    """生成 HSV 三通道查找表（H 通道保持不变）
+
+    与逐像素的 float32 计算逐位一致：先乘饱和度系数或加亮度偏移，
+    裁剪到 [0, 255] 后截断为 uint8。
+    """
+    values = np.arange(256, dtype=np.float32)
+    saturation_factor = 1 + (saturation / 100)
+    brightness_delta = int(brightness * 2.55)
+    lut = np.empty((1, 256, 3), dtype=np.uint8)
+    lut[0, :, 0] = np.arange(256, dtype=np.uint8)
+    lut[0, :, 1] = np.clip(values * saturation_factor, 0, 255).astype(np.uint8)
+    lut[0, :, 2] = np.clip(values + brightness_delta, 0, 255).astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+class ColorAdjuster:
+    """基于查找表的亮度/饱和度调整
+
+    饱和度和亮度都是 8 位值上的逐通道映射，按参数预先生成查找表后只需一次
+    cv2.LUT。HSV 中间缓冲区按线程复用；两个参数都为 0 时直接返回原帧。
+    传入 dst 时结果写入该缓冲区（GPU 路径忽略 dst）。
+    """
+
+    def __init__(self, params, use_gpu=False):
+        self.saturation = params.get('saturation', 0)
+        self.brightness = params.get('brightness', 0)
+        self.use_gpu = use_gpu
+        self.is_identity = self.saturation == 0 and self.brightness == 0
+        self.lut = None if self.is_identity else build_adjust_lut(self.saturation, self.brightness)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _hsv_buffer(self, shape):
+        hsv = getattr(self._local, 'hsv', None)
+        if hsv is None or hsv.shape != shape:
+            hsv = np.empty(shape, dtype=np.uint8)
+            self._local.hsv = hsv
+        return hsv
+
+    def __call__(self, frame, dst=None):
+        if self.is_identity:
+            return frame
+        hsv = self._hsv_buffer(frame.shape)
+        if self.use_gpu:
+            gpu_frame = cv2.cuda_GpuMat()
+            gpu_frame.upload(frame)
+            # 转换到 HSV 颜色空间
+            gpu_hsv = cv2.cuda.cvtColor(gpu_frame, cv2.COLOR_BGR2HSV)
+            gpu_hsv.download(hsv)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv)
+
+        # 一次查表同时调整饱和度 (S) 和亮度 (V)
+        cv2.LUT(hsv, self.lut, dst=hsv)
+
+        if self.use_gpu:
+            gpu_hsv = cv2.cuda_GpuMat()
+            gpu_hsv.upload(hsv)
+            gpu_result = cv2.cuda.cvtColor(gpu_hsv, cv2.COLOR_HSV2BGR)
+            return gpu_result.download()
+        else:
+            return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=dst)
+
+
+def adjust_image(frame, params, use_gpu=False):
+    """应用亮度和饱和度调整"""
+    return ColorAdjuster(params, use_gpu)(frame)
+
+
+class CompiledPipeline:
+    """编译好的处理链：颜色调整的查找表和风格引擎（核大小、查找表等已按参数算好）
+
+    不含任务相关的状态，使用相同风格和参数的任务、预览和批处理可以共用同一个对象。
+    """
+
+    def __init__(self, style, params, use_gpu=False):
+        self.style = style
+        self.params = dict(params)
+        self.use_gpu = use_gpu
+        self.adjuster = ColorAdjuster(params, use_gpu)
+        self.engine = compile_style(style, params, use_gpu)
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_pipeline(style, params_key, use_gpu):
+    return CompiledPipeline(style, dict(params_key), use_gpu)
+
+
+def compile_pipeline(style, params, use_gpu=False):
+    """按风格和参数取得编译好的处理链
+
+    最近使用的几组保留在 LRU 中，在预设之间来回切换或重复提交相同参数的任务时
+    不再重新编译。
+    """
+    return _compile_pipeline(style, tuple(sorted(params.items())), use_gpu)
+
+
+def apply_style(frame, style, params, use_gpu=False):
+    """应用风格化效果（逐帧调用时按风格和参数缓存编译结果）"""
+    return compile_pipeline(style, params, use_gpu).engine(frame)
+
+
+class FrameProcessor:
+    """单帧处理链：缩放 -> 基础调整 -> 风格化（放大输出时可能为 调整 -> 风格化 -> 放大）
+
+    只持有可 pickle 的状态，因此既可在线程池中共享，也可以传给子进程。
+    风格在构造时取自 compile_pipeline 的编译结果，逐帧不再按名称分派。
+    style_fn 为风格化函数 style_fn(frame, out=None)，默认为编译好的风格引擎；大帧
+    可以传入 tiling.TiledStyler 分块处理。stage_timing 为 True 时流水线改用
+    timed_call，分别记录各步骤的耗时。
+
+    各步骤的尺寸由 resolution.plan_resolution 按输入帧尺寸、scale_factor 和风格
+    决定；帧源已经在解码器内缩放时传入对应的 plan，输入帧的尺寸为 plan.decode_size。
+
+    传入 pool（frame_pool.FramePool）时各步骤的结果都通过 dst=/out 写入池中的缓冲区，
+    中间结果用完立即归还；输入帧和返回的输出帧由流水线在写出后归还。pool 不随
+    pickle 传给子进程，进程模式下结果直接写入共享内存槽位。
+    """
+
+    def __init__(self, style, params, use_gpu=False, style_fn=None, stage_timing=False, pool=None,
+                 plan=None):
+        self.style = style
+        self.params = params
+        self.use_gpu = use_gpu
+        self.stage_timing = stage_timing
+        self.pool = pool
+        self.plan = plan
+        compiled = compile_pipeline(style, params, use_gpu)
+        self.adjuster = compiled.adjuster
+        self.engine = compiled.engine
+        self.style_fn = style_fn or self.engine
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def plan_for(self, input_shape):
+        """输入帧尺寸对应的分辨率安排"""
+        if self.plan is not None:
+            return self.plan
+        return plan_resolution((input_shape[1], input_shape[0]), self.params.get('scale_factor', 1.0),
+                               self.engine.upscale_after)
+
+    def output_shape(self, input_shape):
+        """根据输入帧尺寸计算输出帧尺寸"""
+        width, height = self.plan_for(input_shape).output_size
+        return (height, width) + tuple(input_shape[2:])
+
+    def __call__(self, frame):
+        return self._process(frame)
+
+    def timed_call(self, frame):
+        """与 __call__ 相同，另外返回 缩放/调整/风格化 各步骤的耗时（秒），缩放包含风格化后的放大"""
+        marks = [time.perf_counter()]
+        result = self._process(frame, marks)
+        return result, {'resize': marks[1] - marks[0] + marks[4] - marks[3],
+                        'adjust': marks[2] - marks[1], 'style': marks[3] - marks[2]}
+
+    def _acquire(self, shape):
+        return self.pool.acquire(shape) if self.pool is not None else None
+
+    def _settle(self, result, dst):
+        """步骤没有写入 dst（恒等变换或 GPU 路径）时归还 dst"""
+        if dst is not None and result is not dst:
+            self.pool.release(dst)
+        return result
+
+    def _recycle(self, buffer, *keep):
+        """归还用完的中间结果；输入帧或仍作为结果的缓冲区不能归还"""
+        if self.pool is not None and all(buffer is not other for other in keep):
+            self.pool.release(buffer)
+
+    def _resize(self, frame, size):
+        if (frame.shape[1], frame.shape[0]) == size:
+            return frame
+        dst = self._acquire((size[1], size[0]) + frame.shape[2:])
+        return self._settle(resize_to(frame, size, self.use_gpu, dst=dst), dst)
+
+    def _process(self, frame, marks=None):
+        plan = self.plan_for(frame.shape)
+        resized = self._resize(frame, plan.process_size)
+        if marks is not None:
+            marks.append(time.perf_counter())
+        dst = None if self.adjuster.is_identity else self._acquire(resized.shape)
+        adjusted = self._settle(self.adjuster(resized, dst=dst), dst)
+        self._recycle(resized, frame, adjusted)
+        if marks is not None:
+            marks.append(time.perf_counter())
+        dst = self._acquire(adjusted.shape)
+        styled = self._settle(self.style_fn(adjusted, dst), dst)
+        self._recycle(adjusted, frame, styled)
+        if marks is not None:
+            marks.append(time.perf_counter())
+        result = self._resize(styled, plan.output_size)
+        self._recycle(styled, frame, result)
+        if marks is not None:
+            marks.append(time.perf_counter())
+        return result
+
+    def _prepare(self, frame):
+        frame = resize_to(frame, self.plan_for(frame.shape).process_size, self.use_gpu)
+        return self.adjuster(frame)
+
+    def process_batch(self, frames):
+        """处理一批帧，风格化部分交给引擎的 process_batch 以便跨帧向量化"""
+        prepared = [self._prepare(frame) for frame in frames]
+        if self.style_fn is not self.engine:
+            styled = [self.style_fn(frame) for frame in prepared]
+        else:
+            styled = self.engine.process_batch(prepared)
+        return [resize_to(result, self.plan_for(frame.shape).output_size, self.use_gpu)
+                for frame, result in zip(frames, styled)]
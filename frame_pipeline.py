@@ -0,0 +1,198 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from frame_sources import PrefetchReader
+from metrics import DepthStats, StageStats
+from shared_frames import SharedFrameRing, SharedFrameWorker
+
+EXECUTION_MODES = ('serial', 'thread', 'process')
+
+# 子进程内的共享帧处理入口，由进程池的 initializer 设置
+_shared_worker = None
+
+
+def _init_shared_worker(spec, processor):
+    global _shared_worker
+    _shared_worker = SharedFrameWorker(spec, processor)
+
+
+def _process_shared(slot):
+    return _shared_worker(slot)
+
+
+def _timed_call(processor, frame):
+    """处理一帧，返回 (结果, 耗时, 各步骤耗时)；处理器未开启步骤计时时最后一项为 None"""
+    start = time.perf_counter()
+    if getattr(processor, 'stage_timing', False):
+        result, steps = processor.timed_call(frame)
+    else:
+        result, steps = processor(frame), None
+    return result, time.perf_counter() - start, steps
+
+
+class ProcessingCancelled(Exception):
+    """处理被协作式取消"""
+
+
+class FramePipeline:
+    """有界的 解码 -> 风格化 -> 编码 流水线
+
+    解码由 PrefetchReader 在独立线程中预读，风格化分发到线程池或进程池，编码在
+    调用线程中按原始帧顺序完成。解码队列和在途帧数都有上限，长视频的内存占用
+    保持平稳。
+
+    进程模式下帧通过共享内存环形缓冲区传递，槽位数等于在途帧上限；
+    processor 需要提供 output_shape(input_shape) 以便预分配输出槽。
+
+    stats 记录各阶段耗时，depths 在每帧提交时采样预读队列和在途帧的深度；
+    processor 开启 stage_timing 时，缩放/调整/风格化各步骤的耗时也计入 stats。
+
+    传入 skipper（TemporalSkipper）时，在提交前按顺序判断每帧是否可以复用上一个
+    风格化结果，被跳过的帧不进入工作池，写出时重复上一帧的输出。
+
+    传入 pool（frame_pool.FramePool，通常与帧源和 processor 共用）时，每帧写出后
+    把输入帧和输出帧归还池中；进程模式下输入帧拷入共享槽位后立即归还。
+    """
+
+    def __init__(self, processor, num_workers, mode='thread', queue_size=None, skipper=None,
+                 pool=None):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"不支持的执行模式: {mode}")
+        self.processor = processor
+        self.num_workers = max(1, num_workers)
+        self.mode = mode
+        # 解码队列与在途帧数的上限，默认为工作线程数的两倍
+        self.queue_size = queue_size or self.num_workers * 2
+        self.stats = {name: StageStats(name) for name in ('decode', 'process', 'encode')}
+        self.depths = {name: DepthStats(name) for name in ('decode_queue', 'in_flight')}
+        self.wall_time = 0.0
+        self.frames_done = 0
+        self.skipper = skipper
+        self.pool = pool
+        self._last_output = None
+
+    def _create_executor(self, first_frame):
+        if self.mode == 'thread':
+            return ThreadPoolExecutor(max_workers=self.num_workers)
+        if self.mode == 'process':
+            self._ring = SharedFrameRing(self.queue_size, first_frame.shape,
+                                         self.processor.output_shape(first_frame.shape),
+                                         first_frame.dtype)
+            return ProcessPoolExecutor(max_workers=self.num_workers,
+                                       initializer=_init_shared_worker,
+                                       initargs=(self._ring.spec(), self.processor))
+        return None
+
+    def _release(self, frame):
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    def _submit(self, executor, frame):
+        """提交一帧，返回 (future, 共享槽位, 输入帧)"""
+        if executor is None:
+            future = Future()
+            future.set_result(_timed_call(self.processor, frame))
+            return future, None, frame
+        if self.mode == 'process':
+            slot = self._ring.acquire(frame)
+            self._release(frame)
+            return executor.submit(_process_shared, slot), slot, None
+        return executor.submit(_timed_call, self.processor, frame), None, frame
+
+    def _write(self, entry, write_frame, on_frame):
+        future, slot, frame = entry
+        if future is None:
+            processed = self._last_output
+        else:
+            if slot is None:
+                processed, elapsed, steps = future.result()
+            else:
+                elapsed, steps = future.result()
+                processed = self._ring.outputs[slot]
+            self.stats['process'].add(elapsed)
+            if steps is not None:
+                for name, step_time in steps.items():
+                    if name not in self.stats:
+                        self.stats[name] = StageStats(name)
+                    self.stats[name].add(step_time)
+            if self.skipper is not None:
+                # 输出可能是复用的缓冲区或共享槽位，保留一份副本供后续跳过的帧使用
+                if self._last_output is None or self._last_output.shape != processed.shape:
+                    self._last_output = processed.copy()
+                else:
+                    self._last_output[...] = processed
+        start = time.perf_counter()
+        write_frame(processed)
+        self.stats['encode'].add(time.perf_counter() - start)
+        if on_frame is not None:
+            on_frame(self.frames_done, processed)
+        self.frames_done += 1
+        if slot is not None:
+            self._ring.release(slot)
+        # 输出可能就是输入帧（恒等变换），池对重复归还不做处理
+        self._release(frame)
+        self._release(processed)
+
+    def run(self, read_frame, write_frame, on_frame=None, cancel_event=None):
+        """运行流水线
+
+        read_frame() 返回下一帧，读完返回 None；write_frame(frame) 按顺序写入
+        处理后的帧；on_frame(index, frame) 在每帧写入后回调。cancel_event 被设置后
+        不再读取新帧，已提交的帧仍会处理并写出，然后正常返回。
+        """
+        reader = PrefetchReader(read_frame, self.queue_size, stats=self.stats['decode'])
+        executor = None
+        self._ring = None
+        pending = deque()
+        start = time.perf_counter()
+        reader.start()
+        try:
+            while cancel_event is None or not cancel_event.is_set():
+                frame = reader.get()
+                if frame is None:
+                    break
+                if executor is None and self.mode != 'serial':
+                    executor = self._create_executor(frame)
+                if self.skipper is not None and self.skipper.should_reuse(frame):
+                    pending.append((None, None, frame))
+                else:
+                    pending.append(self._submit(executor, frame))
+                self.depths['decode_queue'].observe(reader.depth)
+                self.depths['in_flight'].observe(len(pending))
+                # 在途帧数达到上限时，先按顺序写出最早的一帧
+                if len(pending) >= self.queue_size:
+                    self._write(pending.popleft(), write_frame, on_frame)
+            while pending:
+                self._write(pending.popleft(), write_frame, on_frame)
+        finally:
+            reader.stop()
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+            self.wall_time = time.perf_counter() - start
+        return self.frames_done
+
+    def format_stats(self):
+        """格式化各阶段吞吐，用于日志输出"""
+        lines = [f"流水线 [{self.mode} x{self.num_workers}] 共 {self.frames_done} 帧, "
+                 f"耗时 {self.wall_time:.2f}s, 整体 {self.overall_fps:.1f} fps"]
+        for stage in self.stats.values():
+            lines.append(f"  {stage.name}: {stage.count} 帧, 累计 {stage.busy_time:.2f}s, "
+                         f"{stage.fps:.1f} fps")
+        for depth in self.depths.values():
+            lines.append(f"  {depth.name}: 平均深度 {depth.mean:.1f}, 最大 {depth.max}")
+        if self.pool is not None:
+            pool_stats = self.pool.stats()
+            lines.append(f"  frame_pool: 分配 {pool_stats['allocated']} 块, 复用 {pool_stats['reused']} 次, "
+                         f"共 {pool_stats['nbytes'] / 1024 ** 2:.0f} MB")
+        if self.skipper is not None:
+            lines.append(f"  temporal: 跳过 {self.skipper.skipped}/{self.skipper.frames} 帧, "
+                         f"跳帧率 {self.skipper.skip_ratio:.1%}")
+        return '\n'.join(lines)
+
+    @property
+    def overall_fps(self):
+        return self.frames_done / self.wall_time if self.wall_time > 0 else 0.0
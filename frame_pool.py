@@ -0,0 +1,87 @@
+import math
+import threading
+
+import numpy as np
+
+
+class FramePool:
+    """按 (尺寸, dtype) 复用的帧缓冲区池
+
+    帧源把帧解码进池中的缓冲区，各处理步骤通过 dst= 把结果写进池中的缓冲区，
+    流水线在帧编码写出后把输入帧和输出帧交还池中。4K 下每帧约 25 MB，
+    逐帧新分配会带来明显的分配器开销和内存抖动。
+
+    release() 只回收由本池分配且尚未归还的缓冲区，其他数组（包括池中缓冲区的
+    切片视图、风格引擎直接返回的输入帧）会被忽略，重复归还同一缓冲区也没有副作用。
+    各方法可在多个线程中同时调用。
+    """
+
+    def __init__(self):
+        self._free = {}
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+        self.nbytes = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """取出一块尺寸为 shape 的缓冲区，内容未初始化"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                buffer = free.pop()
+                self.reused += 1
+            else:
+                buffer = None
+                self.allocated += 1
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+            with self._lock:
+                self.nbytes += buffer.nbytes
+        with self._lock:
+            self._in_use[id(buffer)] = buffer
+        return buffer
+
+    def release(self, frame):
+        """归还缓冲区；frame 不是本池分配的缓冲区或已归还时什么也不做"""
+        if frame is None:
+            return
+        with self._lock:
+            buffer = self._in_use.pop(id(frame), None)
+            if buffer is None:
+                return
+            key = (buffer.shape, buffer.dtype.str)
+            self._free.setdefault(key, []).append(buffer)
+
+    def owns(self, frame):
+        """frame 是否为本池分配且尚未归还的缓冲区"""
+        with self._lock:
+            return id(frame) in self._in_use
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allocated': self.allocated,
+                'reused': self.reused,
+                'in_use': len(self._in_use),
+                'nbytes': self.nbytes,
+            }
+
+
+def queue_size_for_memory(input_shape, output_shape, memory_limit, num_workers, max_size=None):
+    """按帧缓冲区的内存上限计算流水线的解码队列与在途帧上限
+
+    队列上限每增加 1，预读队列多一帧输入，在途帧多一帧输入和一帧输出；另外固定
+    占用正在读取和写出的两帧输入，以及每个工作线程的一帧中间结果。结果不超过
+    max_size（默认为工作线程数的四倍），内存不足时至少为 1。
+
+    例如 memory_limit 为 2 GiB、8 个工作线程、输入输出同尺寸时：1080p 为 32
+    （受 max_size 限制），4K 为 25，8K 为 3。
+    """
+    input_bytes = math.prod(input_shape)
+    output_bytes = math.prod(output_shape)
+    fixed = 2 * input_bytes + num_workers * output_bytes
+    per_slot = 2 * input_bytes + output_bytes
+    size = (memory_limit - fixed) // per_slot
+    return int(max(1, min(size, max_size or num_workers * 4)))
@@ -0,0 +1,258 @@
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ffmpeg_io import ffmpeg_available, ffprobe_available, probe_video
+from resolution import plan_resolution
+
+
+class OpenCVFrameSource:
+    """基于 cv2.VideoCapture 的帧源
+
+    CAP_PROP_FRAME_COUNT 由容器时长和帧率推算，VFR 或 MOV 文件常常不准，因此
+    frame_count_exact 为 False；每读一帧记录已读帧数和该帧的时间戳 position（秒），
+    供进度估计按时间戳外推总帧数。info 为 ffprobe 的结果时改用其中的帧数和时长。
+
+    传入 pool（frame_pool.FramePool）时解码到池中的缓冲区，由使用方在用完后归还；
+    否则每帧新分配。
+    """
+
+    def __init__(self, path, info=None, pool=None):
+        self.path = path
+        self.pool = pool
+        self.cap = cv2.VideoCapture(path)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if not self.cap.isOpened() or self.width <= 0 or self.height <= 0:
+            self.cap.release()
+            raise RuntimeError("无法读取视频文件")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.duration = self.frame_count / self.fps if self.fps > 0 else 0.0
+        self.frame_count_exact = False
+        if info is not None:
+            self.frame_count = info['frame_count']
+            self.duration = info['duration']
+            self.frame_count_exact = info['frame_count_exact']
+        self.frame_shape = (self.height, self.width, 3)
+        self.frames_read = 0
+        self.position = 0.0
+
+    def read(self):
+        """读取下一帧，读完返回 None"""
+        if self.pool is None:
+            ret, frame = self.cap.read()
+        else:
+            buffer = self.pool.acquire(self.frame_shape)
+            ret, frame = self.cap.read(buffer)
+            if not ret or frame is not buffer:
+                # 解码出的尺寸与缓冲区不一致时 OpenCV 会另行分配
+                self.pool.release(buffer)
+        if not ret:
+            return None
+        self.frames_read += 1
+        self.position = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        return frame
+
+    def skip(self, count):
+        """跳过开头的若干帧（只 grab 不解码输出）"""
+        for _ in range(count):
+            if not self.cap.grab():
+                break
+            self.frames_read += 1
+
+    def close(self):
+        self.cap.release()
+
+
+class FFmpegFrameSource:
+    """通过 ffmpeg rawvideo 管道解码为 bgr24 帧
+
+    尺寸、帧率和帧数来自 ffprobe，不需要预读首帧或 seek。帧数据用 readinto
+    直接读进缓冲区：传入 pool（frame_pool.FramePool）时从池中取，由使用方在
+    用完后归还，否则每帧新分配。
+
+    start/end（秒）只解码该时间段，用于分块处理；从关键帧开始时无需额外解码。
+    size 为 (宽, 高) 时由 ffmpeg 的 scale 滤镜在 YUV 上缩放后再转 bgr24，
+    管道中传输的和 Python 中处理的都是缩放后的帧；width/height 仍为源视频尺寸。
+    色度按源视频的 4:2:0 采样缩放，细节损失不超过最终 yuv420p 编码本身的损失；
+    先转 bgr24 再缩放会比整帧解码还慢。
+    """
+
+    def __init__(self, path, pool=None, info=None, start=None, end=None, size=None):
+        self.path = path
+        self.info = info or probe_video(path)
+        self.width = self.info['width']
+        self.height = self.info['height']
+        self.fps = self.info['fps']
+        self.frame_count = self.info['frame_count']
+        self.frame_count_exact = self.info['frame_count_exact']
+        self.duration = self.info['duration']
+        # rawvideo 管道不带时间戳，进度估计直接使用 ffprobe 的帧数
+        self.frames_read = 0
+        self.position = None
+        frame_width, frame_height = size or (self.width, self.height)
+        self.frame_shape = (frame_height, frame_width, 3)
+        self.pool = pool
+        self._stderr = tempfile.TemporaryFile()
+        cmd = ['ffmpeg', '-loglevel', 'error', '-nostdin']
+        if start:
+            cmd += ['-ss', f'{start:.6f}']
+        if end is not None:
+            cmd += ['-to', f'{end:.6f}']
+        cmd += ['-i', path, '-map', '0:v:0', '-vsync', 'passthrough']
+        if size is not None:
+            flags = 'area' if frame_width <= self.width and frame_height <= self.height else 'bicubic'
+            cmd += ['-vf', f'scale={frame_width}:{frame_height}:flags={flags}']
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=self._stderr, bufsize=0)
+
+    def read(self):
+        """读取下一帧，读完返回 None"""
+        if self.pool is None:
+            frame = np.empty(self.frame_shape, dtype=np.uint8)
+        else:
+            frame = self.pool.acquire(self.frame_shape)
+        view = memoryview(frame).cast('B')
+        filled = 0
+        while filled < len(view):
+            n = self.process.stdout.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        if filled < len(view) and self.pool is not None:
+            self.pool.release(frame)
+        if filled == 0:
+            self._check_exit()
+            return None
+        if filled < len(view):
+            raise RuntimeError(f"ffmpeg 输出的帧数据不完整: {filled}/{len(view)} 字节")
+        self.frames_read += 1
+        return frame
+
+    def _check_exit(self):
+        if self.process.wait() != 0:
+            self._stderr.seek(0)
+            message = self._stderr.read().decode('utf-8', errors='replace').strip()
+            raise RuntimeError(f"ffmpeg 解码失败: {message}")
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        self._stderr.close()
+
+
+def resolve_decoder(decoder):
+    """解析解码器配置：'auto' 时 ffmpeg 与 ffprobe 都可用才走管道，否则用 OpenCV"""
+    if decoder == 'auto':
+        return 'ffmpeg' if ffmpeg_available() and ffprobe_available() else 'opencv'
+    return decoder
+
+
+def open_frame_source(path, decoder='auto', pool=None, start_frame=0, scale_factor=1.0,
+                      upscale_after=True):
+    """按配置创建帧源：'ffmpeg' / 'opencv'，'auto' 时 ffmpeg 与 ffprobe 都可用才走管道
+
+    start_frame 大于 0 时从该帧开始读取，用于断点续传。pool 为帧缓冲区池，见各帧源的说明。
+    帧源的 plan 属性为 resolution.plan_resolution 按 scale_factor 和风格的
+    upscale_after 给出的分辨率安排；ffmpeg 管道在解码器内完成风格化前的缩放。
+    """
+    decoder = resolve_decoder(decoder)
+    if decoder == 'ffmpeg':
+        if not ffmpeg_available() or not ffprobe_available():
+            raise RuntimeError("ffmpeg 解码需要 ffmpeg 和 ffprobe，请安装后重试或改用 opencv 解码器")
+        info = probe_video(path)
+        start = None
+        if start_frame > 0 and info['fps'] > 0:
+            # 精确 seek 会丢弃时间戳早于 start 的帧，退半帧避免浮点误差丢掉目标帧
+            start = (start_frame - 0.5) / info['fps']
+        plan = plan_resolution((info['width'], info['height']), scale_factor, upscale_after,
+                               decoder_scales=True)
+        source = FFmpegFrameSource(path, pool=pool, info=info, start=start, size=plan.decoder_scale)
+        source.plan = plan
+        return source
+    if decoder == 'opencv':
+        # 有 ffprobe 时用它给出的精确帧数和时长，不依赖 CAP_PROP_FRAME_COUNT
+        info = None
+        if ffprobe_available():
+            try:
+                info = probe_video(path)
+            except RuntimeError:
+                pass
+        source = OpenCVFrameSource(path, info, pool=pool)
+        source.plan = plan_resolution((source.width, source.height), scale_factor, upscale_after)
+        source.skip(start_frame)
+        return source
+    raise ValueError(f"不支持的解码器: {decoder}")
+
+
+class _ReaderError:
+    """把读取线程中的异常带回主线程"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class PrefetchReader:
+    """后台预读线程：提前从帧源读取帧并放入有界队列，与处理过程解耦"""
+
+    _END = object()
+
+    def __init__(self, read_frame, depth, stats=None):
+        self.read_frame = read_frame
+        self.stats = stats
+        self._frames = queue.Queue(maxsize=max(1, depth))
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _read_loop(self):
+        try:
+            while not self._stop_event.is_set():
+                start = time.perf_counter()
+                frame = self.read_frame()
+                if frame is None:
+                    break
+                if self.stats is not None:
+                    self.stats.add(time.perf_counter() - start)
+                self._put(frame)
+        except Exception as e:
+            self._put(_ReaderError(e))
+            return
+        self._put(self._END)
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    @property
+    def depth(self):
+        """预读队列中的帧数（近似值）"""
+        return self._frames.qsize()
+
+    def get(self):
+        """取出下一帧，读完返回 None；读取线程中的异常在这里重新抛出"""
+        item = self._frames.get()
+        if item is self._END:
+            return None
+        if isinstance(item, _ReaderError):
+            raise item.error
+        return item
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
@@ -0,0 +1,234 @@
+import itertools
+import math
+import multiprocessing
+import shutil
+import threading
+
+import cv2
+
+from frame_pipeline import ProcessingCancelled
+from stylizer import VideoStylizer
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def job_workers(width, height, total_cores):
+    """按处理分辨率给任务分配帧级工作线程数
+
+    以 1080p 占一半核数为基准按像素数线性缩放：4K 用满所有核，720p 约四分之一，
+    480p 及以下通常只要一个。小任务因此可以多个并行，避免每个任务都开满线程
+    导致过度订阅。
+    """
+    share = width * height / (1920 * 1080)
+    return max(1, min(total_cores, math.ceil(total_cores * share / 2)))
+
+
+class RenderJob:
+    """队列中的一个渲染任务及其进度"""
+
+    def __init__(self, job_id, input_path, style, params, output_path, priority=0, options=None):
+        self.job_id = job_id
+        self.input_path = input_path
+        self.style = style
+        self.params = params
+        self.output_path = output_path
+        self.priority = priority
+        self.options = options or {}
+        self.state = QUEUED
+        self.workers = 1
+        self.progress = 0
+        self.frames_done = 0
+        self.fps = 0.0
+        self.remaining = -1.0
+        self.error = None
+        self.metrics = None
+        self.stylizer = None
+        self._thread = None
+        self._pause_requested = False
+
+    def as_dict(self):
+        return {
+            'job_id': self.job_id,
+            'input': self.input_path,
+            'style': self.style,
+            'output': self.output_path,
+            'priority': self.priority,
+            'state': self.state,
+            'workers': self.workers,
+            'progress': self.progress,
+            'frames_done': self.frames_done,
+            'fps': self.fps,
+            'remaining': self.remaining,
+            'error': self.error,
+            'metrics': self.metrics,
+        }
+
+
+class JobScheduler:
+    """多任务渲染队列
+
+    按优先级（高者先，同优先级先提交者先）启动任务，同时运行的任务所分配的
+    工作线程数之和不超过 total_cores；队首任务放不下时后面的任务也不越过它启动，
+    大分辨率任务不会被小任务一直插队。
+
+    暂停运行中的任务会协作式取消；任务选项开启 resumable 时已提交的片段保留，
+    继续后从中断处接着处理，否则从头开始。任务状态、进度或指标变化时在工作线程中
+    回调 on_update(job)。
+    """
+
+    def __init__(self, total_cores=None, on_update=None):
+        self.total_cores = total_cores or multiprocessing.cpu_count()
+        self.on_update = on_update
+        self.jobs = []
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._shutting_down = False
+
+    def submit(self, input_path, style, params, output_path, priority=0, options=None):
+        """加入一个任务，返回 RenderJob"""
+        job = RenderJob(next(self._ids), input_path, style, params, output_path, priority, options)
+        cap = cv2.VideoCapture(input_path)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        scale_factor = params.get('scale_factor', 1.0)
+        job.workers = job_workers(int(width * scale_factor), int(height * scale_factor), self.total_cores)
+        with self._lock:
+            self.jobs.append(job)
+            self._notify(job)
+            self._schedule()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return next((job for job in self.jobs if job.job_id == job_id), None)
+
+    def running_jobs(self):
+        with self._lock:
+            return [job for job in self.jobs if job.state == RUNNING]
+
+    def set_priority(self, job_id, priority):
+        with self._lock:
+            job = self.get(job_id)
+            job.priority = priority
+            self._notify(job)
+            self._schedule()
+
+    def pause(self, job_id):
+        with self._lock:
+            job = self.get(job_id)
+            if job.state == QUEUED:
+                job.state = PAUSED
+                self._notify(job)
+            elif job.state == RUNNING:
+                # 工作线程写完在途帧后把状态改为 PAUSED 并让出核数
+                job._pause_requested = True
+                job.stylizer.cancel()
+
+    def resume(self, job_id):
+        with self._lock:
+            job = self.get(job_id)
+            if job.state == PAUSED:
+                job.state = QUEUED
+                self._notify(job)
+                self._schedule()
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.get(job_id)
+            if job.state in (QUEUED, PAUSED):
+                job.state = CANCELLED
+                self._discard_progress(job)
+                self._notify(job)
+            elif job.state == RUNNING:
+                job._pause_requested = False
+                job.stylizer.cancel()
+
+    def shutdown(self, wait=True):
+        """暂停所有运行中的任务（续传模式下保存进度），wait 时等待它们退出
+
+        之后不再启动排队中的任务，暂停的任务退出时也不会让出核数给下一个任务。
+        """
+        with self._lock:
+            self._shutting_down = True
+            for job in self.running_jobs():
+                job._pause_requested = True
+                job.stylizer.cancel()
+            threads = [job._thread for job in self.jobs if job._thread is not None]
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _discard_progress(self, job):
+        """取消的任务不再续传，删除续传/分块的工作目录"""
+        if job.options.get('work_dir'):
+            work_dirs = [job.options['work_dir']]
+        else:
+            work_dirs = [job.output_path + '.work', job.output_path + '.chunks']
+        for work_dir in work_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _schedule(self):
+        with self._lock:
+            if self._shutting_down:
+                return
+            free = self.total_cores - sum(job.workers for job in self.running_jobs())
+            queued = sorted((job for job in self.jobs if job.state == QUEUED),
+                            key=lambda job: (-job.priority, job.job_id))
+            for job in queued:
+                if job.workers > free:
+                    break
+                free -= job.workers
+                self._start(job)
+
+    def _start(self, job):
+        job.state = RUNNING
+        job.error = None
+        job._pause_requested = False
+
+        def on_progress(progress):
+            job.progress = progress
+            self._notify(job)
+
+        def on_eta(frames_done, fps, remaining):
+            job.frames_done, job.fps, job.remaining = frames_done, fps, remaining
+            self._notify(job)
+
+        def on_metrics(snapshot):
+            job.metrics = snapshot
+            self._notify(job)
+
+        options = dict(job.options, num_workers=job.workers)
+        job.stylizer = VideoStylizer(job.input_path, job.style, job.params, options,
+                                     on_progress=on_progress, on_eta=on_eta, on_metrics=on_metrics)
+        job._thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+        self._notify(job)
+        job._thread.start()
+
+    def _run(self, job):
+        try:
+            job.stylizer.process_video(job.output_path)
+            state = DONE
+        except ProcessingCancelled:
+            state = PAUSED if job._pause_requested else CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            state = FAILED
+        with self._lock:
+            job.state = state
+            if state == CANCELLED:
+                self._discard_progress(job)
+            elif state == DONE:
+                job.remaining = 0.0
+            self._notify(job)
+            self._schedule()
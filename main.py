@@ -1,9 +1,28 @@
+import os
 import sys
 from PySide6.QtWidgets import (QApplication, QMainWindow, QFileDialog, QComboBox, 
                              QVBoxLayout, QWidget, QProgressBar, QLabel, QPushButton, 
-                             QHBoxLayout, QSlider, QGroupBox, QFormLayout, QMessageBox)
+                             QHBoxLayout, QSlider, QGroupBox, QFormLayout, QMessageBox,
+                             QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView,
+                             QInputDialog)
 from PySide6.QtCore import Qt, QThread
-from video_processor import VideoProcessor, VideoProcessingThread
+from PySide6.QtGui import QPixmap
+from presets import PresetStore
+from progress import format_remaining
+from video_processor import JobQueueController, PreviewController
+from ffmpeg_io import ffmpeg_available
+from style_engines import available_styles
+
+JOB_COLUMNS = ['输入', '风格', '优先级', '状态', '进度', '速度', '剩余时间']
+JOB_STATE_LABELS = {
+    'queued': '排队中',
+    'running': '处理中',
+    'paused': '已暂停',
+    'done': '已完成',
+    'failed': '失败',
+    'cancelled': '已取消',
+}
+ACTIVE_STATES = ('queued', 'running', 'paused')
 
 
 class VideoStylizationApp(QMainWindow):
@@ -14,10 +33,10 @@ class VideoStylizationApp(QMainWindow):
         self.initFileControls()  # 新增文件控制区域
         self.initStyleSelector()
         self.initParamsPanel()
+        self.initPreviewPanel()
         self.initProcessButton()
+        self.initJobQueue()
         self.initProgressBar()
-        self.video_processor = None
-        self.processing_thread = None
         self.selected_video_path = None
         self.output_video_path = None
 
@@ -73,7 +92,7 @@ class VideoStylizationApp(QMainWindow):
         style_layout = QVBoxLayout()
         
         self.style_selector = QComboBox()
-        self.style_selector.addItems(['油画风格', '水彩风格', '卡通/动漫风格', '素描风格', '复古滤镜', '自定义风格'])
+        self.style_selector.addItems(available_styles())
         style_layout.addWidget(self.style_selector)
         
         style_group.setLayout(style_layout)
@@ -86,6 +105,22 @@ class VideoStylizationApp(QMainWindow):
         # 创建参数调节组
         params_group = QGroupBox("参数调节")
         params_layout = QFormLayout()
+
+        # 参数预设：选择后载入风格和参数，并预先编译处理链
+        self.presets = PresetStore()
+        preset_layout = QHBoxLayout()
+        self.preset_selector = QComboBox()
+        self.preset_selector.setPlaceholderText("选择预设")
+        self.preset_selector.activated.connect(
+            lambda index: self.applyPreset(self.preset_selector.itemText(index)))
+        save_preset_button = QPushButton("保存预设")
+        save_preset_button.clicked.connect(self.savePreset)
+        delete_preset_button = QPushButton("删除预设")
+        delete_preset_button.clicked.connect(self.deletePreset)
+        preset_layout.addWidget(self.preset_selector, stretch=1)
+        preset_layout.addWidget(save_preset_button)
+        preset_layout.addWidget(delete_preset_button)
+        params_layout.addRow("参数预设:", preset_layout)
         
         # 创建强度滑块
         self.strength_slider = QSlider(Qt.Horizontal)
@@ -129,15 +164,152 @@ class VideoStylizationApp(QMainWindow):
         
         params_group.setLayout(params_layout)
         layout.addWidget(params_group)
+        self.refreshPresets()
+
+    def refreshPresets(self, current=None):
+        self.preset_selector.clear()
+        try:
+            self.preset_selector.addItems(self.presets.names())
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, '警告', f'读取预设文件失败：\n{str(e)}')
+        self.preset_selector.setCurrentIndex(self.preset_selector.findText(current) if current else -1)
+
+    def applyPreset(self, name):
+        try:
+            preset = self.presets.get(name)
+            # 预先编译处理链，之后的预览和任务直接复用
+            self.presets.compile(name)
+        except ValueError as e:
+            QMessageBox.warning(self, '警告', f'无法载入预设：\n{str(e)}')
+            return
+        params = preset['params']
+        self.style_selector.setCurrentText(preset['style'])
+        self.strength_slider.setValue(params.get('strength', 50))
+        self.saturation_slider.setValue(params.get('saturation', 0))
+        self.brightness_slider.setValue(params.get('brightness', 0))
+        self.scale_slider.setValue(int(round(params.get('scale_factor', 1.0) * 100)))
+
+    def savePreset(self):
+        name, ok = QInputDialog.getText(self, '保存预设', '预设名称:',
+                                        text=self.preset_selector.currentText())
+        name = name.strip()
+        if not ok or not name:
+            return
+        try:
+            self.presets.save(name, self.style_selector.currentText(), self.currentParams())
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, '错误', f'保存预设失败：\n{str(e)}')
+            return
+        self.refreshPresets(name)
+
+    def deletePreset(self):
+        name = self.preset_selector.currentText()
+        if not name:
+            return
+        try:
+            self.presets.delete(name)
+        except OSError as e:
+            QMessageBox.critical(self, '错误', f'删除预设失败：\n{str(e)}')
+            return
+        self.refreshPresets()
+
+    def initPreviewPanel(self):
+        central_widget = self.centralWidget()
+        layout = central_widget.layout()
+
+        # 创建效果预览组：在低分辨率代理帧上即时显示当前参数的效果
+        preview_group = QGroupBox("效果预览")
+        preview_layout = QVBoxLayout()
+
+        self.preview_label = QLabel("选择视频文件后显示预览")
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setMinimumSize(480, 270)
+        preview_layout.addWidget(self.preview_label)
+
+        # 预览位置滑块：在视频中均匀选取的几个关键帧之间切换
+        self.preview_frame_slider = QSlider(Qt.Horizontal)
+        self.preview_frame_slider.setRange(0, 0)
+        self.preview_frame_slider.setEnabled(False)
+        preview_layout.addWidget(self.preview_frame_slider)
+
+        preview_group.setLayout(preview_layout)
+        layout.addWidget(preview_group)
+
+        self.preview = PreviewController()
+        self.preview.preview_signal.connect(self.showPreview)
+        self.preview.proxies_loaded_signal.connect(self.onPreviewLoaded)
+        self.preview_frame_slider.valueChanged.connect(self.requestPreview)
+        self.style_selector.currentTextChanged.connect(self.requestPreview)
+        for slider in (self.strength_slider, self.saturation_slider, self.brightness_slider):
+            slider.valueChanged.connect(self.requestPreview)
+
+    def currentParams(self):
+        return {
+            'strength': self.strength_slider.value(),
+            'saturation': self.saturation_slider.value(),
+            'brightness': self.brightness_slider.value(),
+            'scale_factor': self.scale_slider.value() / 100.0  # 转换为 0.25 到 1.0
+        }
+
+    def requestPreview(self, *args):
+        # 渲染在后台线程中去抖进行，拖动滑块时界面不会卡顿
+        if self.selected_video_path:
+            self.preview.request(self.style_selector.currentText(), self.currentParams(),
+                                 self.preview_frame_slider.value())
+
+    def onPreviewLoaded(self, count):
+        self.preview_frame_slider.setRange(0, count - 1)
+        self.preview_frame_slider.setEnabled(count > 1)
+
+    def showPreview(self, index, image, final):
+        # 草稿尺寸较小，统一缩放到预览区域大小显示
+        pixmap = QPixmap.fromImage(image).scaled(self.preview_label.size(), Qt.KeepAspectRatio,
+                                                 Qt.SmoothTransformation if final else Qt.FastTransformation)
+        self.preview_label.setPixmap(pixmap)
 
     def initProcessButton(self):
-        self.process_button = QPushButton('开始处理视频', self)
+        self.process_button = QPushButton('加入处理队列', self)
         self.process_button.clicked.connect(self.onProcessButtonClicked)
         self.process_button.setEnabled(False)
         central_widget = self.centralWidget()
         layout = central_widget.layout()
         layout.addWidget(self.process_button)
 
+    def initJobQueue(self):
+        central_widget = self.centralWidget()
+        layout = central_widget.layout()
+
+        # 创建任务队列组：可以连续加入多个任务，由调度器按核数和分辨率决定同时运行几个
+        queue_group = QGroupBox("任务队列")
+        queue_layout = QVBoxLayout()
+
+        self.job_table = QTableWidget(0, len(JOB_COLUMNS))
+        self.job_table.setHorizontalHeaderLabels(JOB_COLUMNS)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.job_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.job_table.itemSelectionChanged.connect(self.onJobSelectionChanged)
+        queue_layout.addWidget(self.job_table)
+
+        buttons_layout = QHBoxLayout()
+        for text, handler in (('暂停', self.pauseSelectedJobs),
+                              ('继续', self.resumeSelectedJobs),
+                              ('取消', self.cancelSelectedJobs),
+                              ('提高优先级', lambda: self.changeSelectedPriority(1)),
+                              ('降低优先级', lambda: self.changeSelectedPriority(-1))):
+            button = QPushButton(text)
+            button.clicked.connect(handler)
+            buttons_layout.addWidget(button)
+        queue_layout.addLayout(buttons_layout)
+
+        queue_group.setLayout(queue_layout)
+        layout.addWidget(queue_group)
+
+        self.job_queue = JobQueueController()
+        self.job_queue.job_updated.connect(self.onJobUpdated)
+        self.job_rows = {}
+        self.jobs = {}
+
     def initProgressBar(self):
         self.progress_bar = QProgressBar()
         self.progress_label = QLabel('进度: 0%')
@@ -164,7 +336,16 @@ class VideoStylizationApp(QMainWindow):
             file_path = file_dialog.selectedFiles()[0]
             self.selected_video_path = file_path
             self.input_path_label.setText(file_path)
+            if not self.output_video_path:
+                # 默认输出到输入文件旁边，便于连续加入多个任务
+                stem = os.path.splitext(file_path)[0]
+                self.output_video_path = f'{stem}_styled.mp4'
+                self.output_path_label.setText(self.output_video_path)
             self.updateProcessButton()
+            self.preview_frame_slider.setValue(0)
+            self.preview_frame_slider.setEnabled(False)
+            self.preview.open(file_path)
+            self.requestPreview()
 
     def updateProcessButton(self):
         # 只有当输入和输出路径都设置后才启用处理按钮
@@ -177,66 +358,131 @@ class VideoStylizationApp(QMainWindow):
             self.startVideoProcessing(self.selected_video_path)
 
     def startVideoProcessing(self, video_path):
-        self.style_selector.setEnabled(False)
-        self.process_button.setEnabled(False)
         style = self.style_selector.currentText()
         # 检查是否选择了支持的风格
-        supported_styles = ['油画风格', '水彩风格', '卡通/动漫风格', '素描风格', '复古滤镜', '自定义风格']
-        if style not in supported_styles:
+        if style not in available_styles():
             QMessageBox.warning(self, '警告', '所选风格暂不支持，请重新选择。')
-            self.style_selector.setEnabled(True)
-            self.process_button.setEnabled(True)
             return
-            
-        # 获取参数值
-        params = {
-            'strength': self.strength_slider.value(),
-            'saturation': self.saturation_slider.value(),
-            'brightness': self.brightness_slider.value(),
-            'scale_factor': self.scale_slider.value() / 100.0  # 转换为 0.25 到 1.0
-        }
-        
-        try:
-            self.video_processor = VideoProcessor(video_path, style, params)
-            self.processing_thread = VideoProcessingThread(self.video_processor, self.output_video_path)
+        if any(job['output'] == self.output_video_path and job['state'] in ACTIVE_STATES
+               for job in self.jobs.values()):
+            QMessageBox.warning(self, '警告', '队列中已有输出到该路径的任务，请设置其他输出路径。')
+            return
 
-            self.video_processor.progress_signal.connect(self.updateProgress)
-            self.video_processor.finished_signal.connect(self.processingFinished)
-            self.video_processor.preview_frame_signal.connect(self.showProcessedPreview)
+        # 获取参数值
+        params = self.currentParams()
 
-            # 启动处理线程
-            self.processing_thread.start()
+        try:
+            # 有 ffmpeg 时按片段编码，暂停或退出程序后可以从中断处继续
+            options = {'resumable': ffmpeg_available(), 'metrics': True}
+            self.job_queue.submit(video_path, style, params, self.output_video_path, options=options)
         except Exception as e:
             QMessageBox.critical(self, '错误', f'处理视频时出错：\n{str(e)}')
-            self.style_selector.setEnabled(True)
-            self.process_button.setEnabled(True)
+            return
+        # 下一个任务需要新的输出路径
+        self.output_video_path = None
+        self.output_path_label.setText("未设置输出路径")
+        self.updateProcessButton()
+
+    def selectedJobIds(self):
+        rows = {index.row() for index in self.job_table.selectionModel().selectedRows()}
+        return [job_id for job_id, row in self.job_rows.items() if row in rows]
+
+    def pauseSelectedJobs(self):
+        for job_id in self.selectedJobIds():
+            self.job_queue.pause(job_id)
 
-    def updateProgress(self, progress):
+    def resumeSelectedJobs(self):
+        for job_id in self.selectedJobIds():
+            self.job_queue.resume(job_id)
+
+    def cancelSelectedJobs(self):
+        for job_id in self.selectedJobIds():
+            self.job_queue.cancel(job_id)
+
+    def changeSelectedPriority(self, delta):
+        for job_id in self.selectedJobIds():
+            self.job_queue.set_priority(job_id, self.jobs[job_id]['priority'] + delta)
+
+    def onJobUpdated(self, job):
+        previous = self.jobs.get(job['job_id'])
+        self.jobs[job['job_id']] = job
+        row = self.job_rows.get(job['job_id'])
+        if row is None:
+            row = self.job_table.rowCount()
+            self.job_rows[job['job_id']] = row
+            self.job_table.insertRow(row)
+            self.job_table.setItem(row, 0, QTableWidgetItem(os.path.basename(job['input'])))
+            self.job_table.setItem(row, 1, QTableWidgetItem(job['style']))
+            progress_bar = QProgressBar()
+            self.job_table.setCellWidget(row, 4, progress_bar)
+        self.job_table.item(row, 0).setToolTip(f"{job['input']}\n-> {job['output']}")
+        self.job_table.setItem(row, 2, QTableWidgetItem(str(job['priority'])))
+        state_text = JOB_STATE_LABELS[job['state']]
+        if job['state'] == 'running':
+            state_text += f" ({job['workers']} 线程)"
+        self.job_table.setItem(row, 3, QTableWidgetItem(state_text))
+        self.job_table.cellWidget(row, 4).setValue(job['progress'])
+        self.job_table.setItem(row, 5, QTableWidgetItem(f"{job['fps']:.1f} fps" if job['fps'] else ''))
+        remaining = job['remaining'] if job['remaining'] >= 0 else None
+        self.job_table.setItem(row, 6, QTableWidgetItem(
+            format_remaining(remaining) if job['state'] == 'running' else ''))
+
+        if job['metrics'] and job['job_id'] in self.selectedJobIds():
+            self.updateMetrics(job['metrics'])
+        self.updateOverallProgress()
+
+        if previous is not None and previous['state'] != job['state']:
+            if job['state'] == 'done':
+                print('视频处理完成')
+                self.statusBar().showMessage(f"视频已保存到：{job['output']}")
+            elif job['state'] == 'failed':
+                QMessageBox.warning(self, '处理失败', f"{job['input']}\n{job['error']}")
+
+    def onJobSelectionChanged(self):
+        for job_id in self.selectedJobIds():
+            if self.jobs[job_id]['metrics']:
+                self.updateMetrics(self.jobs[job_id]['metrics'])
+
+    def updateOverallProgress(self):
+        # 状态栏显示队列中未取消任务的总体进度和运行中任务的最长剩余时间
+        jobs = [job for job in self.jobs.values() if job['state'] not in ('cancelled', 'failed')]
+        if not jobs:
+            return
+        progress = int(sum(100 if job['state'] == 'done' else job['progress'] for job in jobs) / len(jobs))
+        running = [job for job in jobs if job['state'] == 'running']
         self.progress_bar.setValue(progress)
-        self.progress_label.setText(f'进度: {progress}%')
+        text = f'进度: {progress}%  运行 {len(running)} / 共 {len(jobs)} 个任务'
+        if running:
+            remaining = [job['remaining'] for job in running]
+            text += f"  剩余 {format_remaining(max(remaining) if min(remaining) >= 0 else None)}"
+        self.progress_label.setText(text)
 
-    def processingFinished(self):
-        self.progress_bar.setValue(100)
-        self.progress_label.setText('进度: 100%')
-        print('视频处理完成')
-        QMessageBox.information(self, '处理完成', f'视频已保存到：\n{self.output_video_path}')
-        self.style_selector.setEnabled(True)
-        self.process_button.setEnabled(True)
+    def updateMetrics(self, snapshot):
+        # 在状态栏显示各阶段的单路吞吐和预读队列深度，便于判断瓶颈所在
+        stages = snapshot['stages']
+        parts = [f"{name} {stages[name]['fps']:.1f} fps"
+                 for name in ('decode', 'style', 'encode') if stages.get(name, {}).get('count')]
+        queue = snapshot['depths'].get('decode_queue')
+        if queue:
+            parts.append(f"解码队列 {queue['mean']:.1f}")
+        self.statusBar().showMessage('  |  '.join(parts))
 
     def closeEvent(self, event):
-        if self.processing_thread and self.processing_thread.isRunning():
+        if self.job_queue.running_jobs():
             reply = QMessageBox.question(self, '确认退出', 
                                        '视频正在处理中，确定要退出吗？',
                                        QMessageBox.Yes | QMessageBox.No,
                                        QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.processing_thread.terminate()
-                self.processing_thread.wait()
+                # 协作式暂停：写完已提交的帧并保存当前片段，而不是强行终止线程
+                self.job_queue.shutdown(wait=True)
                 event.accept()
             else:
                 event.ignore()
         else:
             event.accept()
+        if event.isAccepted():
+            self.preview.close()
 
     def showProcessedPreview(self, frame):
         # 由于我们不再需要预览，这个方法可以保留为空
@@ -0,0 +1,159 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from checkpoint import write_json_atomic
+
+# 耗时直方图各桶的上界（秒），最后另有一个 +Inf 桶
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageStats:
+    """单个阶段的次数、累计耗时和单次耗时直方图"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy_time = 0.0
+        self.buckets = [0] * (len(TIME_BUCKETS) + 1)
+        self._lock = threading.Lock()
+
+    def add(self, elapsed, count=1):
+        bucket = bisect.bisect_left(TIME_BUCKETS, elapsed / count)
+        with self._lock:
+            self.count += count
+            self.busy_time += elapsed
+            self.buckets[bucket] += count
+
+    def merge(self, data):
+        """合并另一个阶段的 as_dict() 结果（例如分块子进程的统计）"""
+        with self._lock:
+            self.count += data['count']
+            self.busy_time += data['busy_time']
+            for i, n in enumerate(data['buckets']):
+                self.buckets[i] += n
+
+    @property
+    def fps(self):
+        """该阶段单路吞吐（帧/秒），不含等待时间"""
+        return self.count / self.busy_time if self.busy_time > 0 else 0.0
+
+    def as_dict(self):
+        return {'count': self.count, 'busy_time': self.busy_time, 'fps': self.fps,
+                'buckets': list(self.buckets)}
+
+
+class DepthStats:
+    """队列深度的采样统计，由流水线的调度线程在每帧提交时采样"""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+        self.last = 0
+
+    def observe(self, depth):
+        self.samples += 1
+        self.total += depth
+        self.last = depth
+        if depth > self.max:
+            self.max = depth
+
+    def merge(self, data):
+        self.samples += data['samples']
+        self.total += data['total']
+        self.max = max(self.max, data['max'])
+        self.last = data['last']
+
+    @property
+    def mean(self):
+        return self.total / self.samples if self.samples else 0.0
+
+    def as_dict(self):
+        return {'samples': self.samples, 'total': self.total, 'max': self.max,
+                'last': self.last, 'mean': self.mean}
+
+
+class JobMetrics:
+    """一次任务的指标：各阶段耗时统计、队列深度，以及音频、拼接等一次性步骤的耗时
+
+    attach() 让流水线直接把统计记录在本对象中，处理过程中随时可以 snapshot()。
+    结果可以写成 JSON 或 Prometheus 文本格式（node_exporter textfile 收集器可直接读取）。
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.depths = {}
+        self.started = time.time()
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    def depth(self, name):
+        if name not in self.depths:
+            self.depths[name] = DepthStats(name)
+        return self.depths[name]
+
+    def attach(self, pipeline):
+        # 共用同一个字典，流水线之后才创建的步骤统计（resize/adjust/style）也会包含在内
+        self.stages.update(pipeline.stats)
+        self.depths.update(pipeline.depths)
+        pipeline.stats = self.stages
+        pipeline.depths = self.depths
+
+    @contextmanager
+    def timed(self, name):
+        """记录一个步骤的耗时，例如 with metrics.timed('audio_mux'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(name).add(time.perf_counter() - start)
+
+    def merge(self, snapshot):
+        for name, data in snapshot['stages'].items():
+            self.stage(name).merge(data)
+        for name, data in snapshot['depths'].items():
+            self.depth(name).merge(data)
+
+    def snapshot(self):
+        return {
+            'elapsed': time.time() - self.started,
+            'stages': {name: stage.as_dict() for name, stage in list(self.stages.items())},
+            'depths': {name: depth.as_dict() for name, depth in list(self.depths.items())},
+        }
+
+    def to_prometheus(self, prefix='stylizer'):
+        snapshot = self.snapshot()
+        lines = [f'# HELP {prefix}_stage_seconds 各阶段单次耗时（秒）',
+                 f'# TYPE {prefix}_stage_seconds histogram']
+        for name, stage in snapshot['stages'].items():
+            cumulative = 0
+            for bound, n in zip(TIME_BUCKETS + ('+Inf',), stage['buckets']):
+                cumulative += n
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["busy_time"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        for field in ('max', 'mean'):
+            lines.append(f'# HELP {prefix}_queue_depth_{field} 队列深度（{field}）')
+            lines.append(f'# TYPE {prefix}_queue_depth_{field} gauge')
+            for name, depth in snapshot['depths'].items():
+                lines.append(f'{prefix}_queue_depth_{field}{{queue="{name}"}} {depth[field]:g}')
+        lines.append(f'# TYPE {prefix}_elapsed_seconds gauge')
+        lines.append(f'{prefix}_elapsed_seconds {snapshot["elapsed"]:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """写出指标文件：.json 为 JSON，其余扩展名为 Prometheus 文本格式"""
+        if path.endswith('.json'):
+            write_json_atomic(path, self.snapshot())
+            return
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+from checkpoint import write_json_atomic
+from frame_ops import compile_pipeline
+from style_engines import available_styles
+
+PRESETS_VERSION = 1
+
+
+class PresetStore:
+    """命名预设（风格 + 参数）的持久化存储
+
+    预设文件在首次访问时解析一次并按名称建立索引，之后的查询都在内存中完成；
+    只有文件被其他进程修改（修改时间或大小变化）时才重新读取。保存和删除通过
+    write_json_atomic 原子替换整个文件，写入中途退出不会损坏已有预设。
+    也能读取旧版 save_presets 写出的 {名称: 预设} 格式，下次保存时转换为新格式。
+
+    compile(name) 返回预设对应的 frame_ops.CompiledPipeline，编译结果在
+    compile_pipeline 的 LRU 中共享，在预设之间切换不会重复编译。
+    """
+
+    def __init__(self, path='presets.json'):
+        self.path = path
+        self._presets = {}
+        self._signature = None
+        self._lock = threading.RLock()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        presets = {}
+        if signature is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = data.get('presets', {}) if 'version' in data else data
+            presets = {name: {'style': entry['style'], 'params': dict(entry.get('params', {}))}
+                       for name, entry in entries.items()
+                       if isinstance(entry, dict) and 'style' in entry}
+        self._presets = presets
+        self._signature = signature
+
+    def _write(self):
+        write_json_atomic(self.path, {'version': PRESETS_VERSION, 'presets': self._presets})
+        self._signature = self._file_signature()
+
+    def names(self):
+        with self._lock:
+            self._refresh()
+            return sorted(self._presets)
+
+    def get(self, name):
+        """返回 {'style': ..., 'params': {...}} 的副本"""
+        with self._lock:
+            self._refresh()
+            preset = self._presets.get(name)
+            if preset is None:
+                raise ValueError(f"预设不存在: {name}")
+            return {'style': preset['style'], 'params': dict(preset['params'])}
+
+    def save(self, name, style, params):
+        """保存（或覆盖）一个预设"""
+        if style not in available_styles():
+            raise ValueError(f"不支持的风格: {style}")
+        with self._lock:
+            self._refresh()
+            self._presets[name] = {'style': style, 'params': dict(params)}
+            self._write()
+
+    def delete(self, name):
+        with self._lock:
+            self._refresh()
+            if self._presets.pop(name, None) is not None:
+                self._write()
+
+    def compile(self, name, use_gpu=False):
+        """载入预设并返回编译好的处理链"""
+        preset = self.get(name)
+        return compile_pipeline(preset['style'], preset['params'], use_gpu)
@@ -0,0 +1,187 @@
+import threading
+import time
+
+import cv2
+
+from ffmpeg_io import ffprobe_available, probe_keyframes
+from frame_ops import FrameProcessor
+
+
+def _fit(frame, max_size):
+    """把帧等比缩小到 max_size 以内（只缩小不放大）"""
+    height, width = frame.shape[:2]
+    scale = min(1.0, max_size[0] / width, max_size[1] / height)
+    if scale == 1.0:
+        return frame
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def _sample_times(video_path, count, duration):
+    """均匀选取 count 个时间点；有 ffprobe 时对齐到最近的关键帧，seek 后无需向后解码"""
+    times = [duration * (i + 0.5) / count for i in range(count)]
+    if not ffprobe_available():
+        return times
+    try:
+        keyframes = probe_keyframes(video_path)
+    except RuntimeError:
+        return times
+    if not keyframes:
+        return times
+    snapped = sorted({min(keyframes, key=lambda k: abs(k - t)) for t in times})
+    return snapped
+
+
+def load_proxies(video_path, count=8, max_size=(480, 270)):
+    """解码稀疏的一组代理帧并缩小到 max_size 以内，返回 [(时间秒, 帧)]"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError("无法读取视频文件")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration = frame_count / fps if frame_count > 0 else 0.0
+        proxies = []
+        times = _sample_times(video_path, count, duration) if duration else [0.0]
+        for t in times:
+            cap.set(cv2.CAP_PROP_POS_MSEC, t * 1000.0)
+            ret, frame = cap.read()
+            if ret:
+                proxies.append((t, _fit(frame, max_size)))
+        if not proxies:
+            raise RuntimeError("无法读取视频文件")
+        return proxies
+    finally:
+        cap.release()
+
+
+class PreviewRenderer:
+    """参数调节的即时预览：在后台线程里对内存中的低分辨率代理帧重跑 调整 + 风格化
+
+    open() 在后台解码一组稀疏的代理帧并缓存；request() 提交一次渲染请求后立即返回。
+    请求经过 debounce 秒的去抖，连续拖动滑块时只渲染最后一次；渲染开始前被新请求
+    替换的请求直接丢弃，渲染完成时已过期的结果也不会回调。
+
+    结果通过 on_result(generation, index, frame, final) 回调，代理帧加载完成后
+    回调 on_loaded(count)，两者都在后台线程中调用。
+    风格在代理帧上超过 budget 秒时先在一半尺寸的草稿上渲染并回调 final=False，
+    没有更新的请求时再渲染完整代理帧并回调 final=True。
+    """
+
+    def __init__(self, on_result, on_loaded=None, count=8, max_size=(480, 270),
+                 debounce=0.05, budget=0.1):
+        self.on_result = on_result
+        self.on_loaded = on_loaded
+        self.count = count
+        self.max_size = max_size
+        self.debounce = debounce
+        self.budget = budget
+        self.proxies = []
+        self._drafts = []
+        self._render_times = {}
+        self._source = None
+        self._pending = None
+        self._requested_at = 0.0
+        self._generation = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='preview', daemon=True)
+        self._thread.start()
+
+    def open(self, video_path):
+        """在后台加载新视频的代理帧，已提交的请求在加载完成后渲染"""
+        with self._cond:
+            self._source = video_path
+            self.proxies = []
+            self._drafts = []
+            self._cond.notify()
+
+    def request(self, style, params, index=0):
+        """提交渲染请求，返回请求序号；之前尚未开始的请求被替换"""
+        with self._cond:
+            self._generation += 1
+            self._pending = (self._generation, style, dict(params), index)
+            self._requested_at = time.monotonic()
+            self._cond.notify()
+            return self._generation
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _is_stale(self, generation):
+        return generation != self._generation or self._closed
+
+    def _next_task(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                if self._source is not None:
+                    source, self._source = self._source, None
+                    return 'load', source
+                if self._pending is not None and self.proxies:
+                    # 去抖：最后一次请求后 debounce 秒内没有新请求才开始渲染
+                    remaining = self._requested_at + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        request, self._pending = self._pending, None
+                        return 'render', request
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+
+    def _load(self, video_path):
+        try:
+            proxies = [frame for _, frame in load_proxies(video_path, self.count, self.max_size)]
+        except RuntimeError as e:
+            print(f"加载预览帧失败: {str(e)}")
+            return
+        drafts = [_fit(frame, (frame.shape[1] // 2, frame.shape[0] // 2)) for frame in proxies]
+        with self._cond:
+            # 加载期间又打开了别的视频时丢弃结果
+            if self._source is not None:
+                return
+            self.proxies, self._drafts = proxies, drafts
+            self._cond.notify()
+        if self.on_loaded is not None:
+            self.on_loaded(len(proxies))
+
+    def _render(self, request):
+        generation, style, params, index = request
+        # open() 可能在另一个线程中清空代理帧，取快照后再使用
+        with self._cond:
+            proxies, drafts = self.proxies, self._drafts
+        if not proxies:
+            return
+        params['scale_factor'] = 1.0  # 代理帧已经是预览尺寸
+        processor = FrameProcessor(style, params)
+        index = min(max(0, index), len(proxies) - 1)
+
+        # 还没有耗时记录的风格也先出草稿
+        if self._render_times.get(style, float('inf')) > self.budget:
+            draft = processor(drafts[index])
+            if self._is_stale(generation):
+                return
+            self.on_result(generation, index, draft, False)
+
+        start = time.perf_counter()
+        frame = processor(proxies[index])
+        self._render_times[style] = time.perf_counter() - start
+        if not self._is_stale(generation):
+            self.on_result(generation, index, frame, True)
+
+    def _run(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            kind, arg = task
+            try:
+                if kind == 'load':
+                    self._load(arg)
+                else:
+                    self._render(arg)
+            except Exception as e:
+                print(f"预览渲染失败: {str(e)}")
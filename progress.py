@@ -0,0 +1,84 @@
+import math
+import time
+
+
+class ProgressTracker:
+    """帧级进度与剩余时间估计
+
+    总帧数优先使用 ffprobe 的精确计数；帧源只能给出估计值时（OpenCV 的
+    CAP_PROP_FRAME_COUNT 对 VFR/MOV 文件常常不准），按已读帧的时间戳和总时长
+    外推总帧数。吞吐用按时间加权的 EWMA 平滑，时间常数为 tau 秒；
+    剩余时间 = 剩余帧数 / 平滑后的吞吐。
+
+    update() 每隔 interval 秒返回一次 True，调用方据此发送进度，
+    不再依赖"当前帧号等于总帧数"来触发最后一次更新。
+    """
+
+    def __init__(self, total_frames=0, duration=0.0, exact=False, start_frame=0,
+                 tau=5.0, interval=0.25):
+        self.total_frames = total_frames
+        self.duration = duration
+        self.exact = exact
+        self.frames_done = start_frame
+        self.tau = tau
+        self.interval = interval
+        self.fps = 0.0
+        self._last_time = None
+        self._last_frames = start_frame
+
+    def estimate_total(self, frames_read, position):
+        """用帧源最近读出的帧数和时间戳（秒）修正总帧数，总帧数精确时忽略"""
+        if self.exact or not self.duration or not position or not frames_read:
+            return
+        self.total_frames = max(self.frames_done, int(round(frames_read * self.duration / position)))
+
+    def update(self, frames_done, now=None):
+        """记录已完成的帧数（含续传前已完成的部分），返回是否到了发送进度的时间"""
+        now = time.monotonic() if now is None else now
+        self.frames_done = frames_done
+        if self._last_time is None:
+            # 从第一帧写出开始计时，不把进程池启动等准备时间算进吞吐
+            self._last_time = now
+            self._last_frames = frames_done
+            return True
+        elapsed = now - self._last_time
+        if elapsed < self.interval:
+            return False
+        rate = (frames_done - self._last_frames) / elapsed
+        if self.fps == 0.0:
+            self.fps = rate
+        else:
+            self.fps += (1 - math.exp(-elapsed / self.tau)) * (rate - self.fps)
+        self._last_time = now
+        self._last_frames = frames_done
+        return True
+
+    def finish(self):
+        """处理结束：实际写出的帧数就是总帧数"""
+        self.total_frames = self.frames_done
+        self.exact = True
+
+    @property
+    def fraction(self):
+        if self.total_frames <= 0:
+            return 0.0
+        return min(1.0, self.frames_done / self.total_frames)
+
+    @property
+    def remaining(self):
+        """剩余时间（秒），总帧数或吞吐未知时返回 None"""
+        if self.total_frames <= 0 or self.fps <= 0:
+            return None
+        return max(0, self.total_frames - self.frames_done) / self.fps
+
+
+def format_remaining(seconds):
+    """把剩余秒数格式化为 时:分:秒 或 分:秒，未知时返回 '--:--'"""
+    if seconds is None:
+        return '--:--'
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes:02d}:{seconds:02d}'
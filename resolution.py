@@ -0,0 +1,58 @@
+import cv2
+
+
+def scaled_size(size, scale_factor):
+    """按缩放比例计算 (宽, 高)，与逐帧缩放的取整方式一致"""
+    width, height = size
+    if scale_factor == 1.0:
+        return (width, height)
+    return (int(width * scale_factor), int(height * scale_factor))
+
+
+def interpolation_for(src_size, dst_size):
+    """缩小用 INTER_AREA（按面积平均，不产生摩尔纹），放大用 INTER_CUBIC"""
+    if dst_size[0] <= src_size[0] and dst_size[1] <= src_size[1]:
+        return cv2.INTER_AREA
+    return cv2.INTER_CUBIC
+
+
+class ResolutionPlan:
+    """一次任务中各阶段的帧尺寸，均为 (宽, 高)
+
+    source_size 为源视频尺寸；decode_size 为帧源输出的尺寸（解码器内已缩放时
+    与 source_size 不同）；process_size 为调整和风格化所用的尺寸；output_size 为
+    编码尺寸。decode_size 与 process_size 不同时在风格化前缩放，process_size 与
+    output_size 不同时在风格化后缩放。
+    """
+
+    def __init__(self, source_size, decode_size, process_size, output_size):
+        self.source_size = tuple(source_size)
+        self.decode_size = tuple(decode_size)
+        self.process_size = tuple(process_size)
+        self.output_size = tuple(output_size)
+
+    @property
+    def decoder_scale(self):
+        """需要解码器输出的尺寸，不需要在解码器内缩放时为 None"""
+        return self.decode_size if self.decode_size != self.source_size else None
+
+    def __repr__(self):
+        return (f'ResolutionPlan(source={self.source_size}, decode={self.decode_size}, '
+                f'process={self.process_size}, output={self.output_size})')
+
+
+def plan_resolution(source_size, scale_factor, upscale_after=True, decoder_scales=False):
+    """为一个风格选择处理分辨率
+
+    缩小输出时总是先缩小再风格化，滤波的像素数随缩放比例的平方减少。放大输出时，
+    upscale_after 为 True 的风格（风格引擎的同名属性）先在原分辨率风格化再放大，
+    否则先放大再风格化。decoder_scales 为 True 时风格化前的缩放交给解码器完成
+    （ffmpeg scale 滤镜），原分辨率的帧不进入 Python。
+    """
+    output_size = scaled_size(source_size, scale_factor)
+    if scale_factor > 1.0 and upscale_after:
+        process_size = tuple(source_size)
+    else:
+        process_size = output_size
+    decode_size = process_size if decoder_scales else tuple(source_size)
+    return ResolutionPlan(source_size, decode_size, process_size, output_size)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from checkpoint import write_json_atomic
+
+# 参数缺省值，与 VideoStylizer 的默认参数保持一致，用于归一化缓存键
+DEFAULT_PARAMS = {
+    'strength': 50,
+    'saturation': 0,
+    'brightness': 0,
+    'scale_factor': 1.0,
+}
+
+# 渲染实现改变了输出内容时递增，旧的缓存条目随之失效
+RENDER_VERSION = 2
+
+
+def source_fingerprint(path, block_size=64 * 1024, samples=8):
+    """快速源文件指纹：文件大小 + 修改时间 + 均匀抽样若干数据块的哈希
+
+    不读取整个文件，几 GB 的视频也只需要读取 samples * block_size 字节。
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    with open(path, 'rb') as f:
+        if stat.st_size <= block_size * samples:
+            digest.update(f.read())
+        else:
+            step = (stat.st_size - block_size) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def normalize_params(params):
+    """补全缺省值并统一数值类型，使等价的参数得到相同的缓存键"""
+    normalized = dict(DEFAULT_PARAMS, **(params or {}))
+    return {key: round(float(value), 6) if isinstance(value, (int, float)) else value
+            for key, value in sorted(normalized.items())}
+
+
+def result_key(fingerprint, style, params, extra=None):
+    """由源指纹、风格、归一化参数以及编码设置等附加信息生成缓存键"""
+    key = {
+        'source': fingerprint,
+        'style': style,
+        'params': normalize_params(params),
+        'extra': extra or {},
+        'version': RENDER_VERSION,
+    }
+    data = json.dumps(key, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def segment_key(key, start, end):
+    """分块片段的缓存键：同一任务下时间段相同的片段内容相同"""
+    data = f'{key}:{start}:{end}'.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def _place_file(src, dst, link):
+    """把文件放到 dst：先写临时文件再替换，中断时不会留下半个文件
+
+    link=True 时在同一文件系统内用硬链接，避免再拷贝一遍视频数据；只适用于
+    不会被原地改写的文件（分块片段总是整体替换），最终输出文件可能被
+    ffmpeg -y 原地截断，必须拷贝。
+    """
+    tmp_path = dst + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if link:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copy2(src, tmp_path)
+    else:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class ResultCache:
+    """按内容寻址的输出缓存，按总大小做 LRU 淘汰
+
+    条目可以是完整的输出文件，也可以是分块处理的单个片段。索引保存在
+    cache_dir/index.json 中，并记录命中/未命中次数。索引只在进程内加锁，
+    多个进程共用同一目录时以最后写入的索引为准。
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                # 去掉文件已被外部删除的条目
+                index['entries'] = {key: entry for key, entry in index['entries'].items()
+                                    if os.path.exists(os.path.join(self.cache_dir, entry['file']))}
+                return index
+            except (ValueError, KeyError):
+                print("缓存索引损坏，重新建立")
+        return {'entries': {}, 'hits': 0, 'misses': 0}
+
+    def _save_index(self):
+        write_json_atomic(self.index_path, self._index)
+
+    def fetch(self, key, dst_path, link=False):
+        """命中时把缓存文件放到 dst_path 并返回 True
+
+        索引载入后缓存文件被外部删除时按未命中处理，并从索引中去掉该条目。
+        """
+        with self._lock:
+            entry = self._index['entries'].get(key)
+        stale = None
+        if entry is not None:
+            try:
+                _place_file(os.path.join(self.cache_dir, entry['file']), dst_path, link)
+            except FileNotFoundError:
+                stale, entry = entry, None
+        with self._lock:
+            if entry is None:
+                # 放置文件期间可能有其他任务重新存入了同一个键，只去掉失效的那一项
+                if stale is not None and self._index['entries'].get(key) is stale:
+                    del self._index['entries'][key]
+                self._index['misses'] += 1
+            else:
+                entry['last_access'] = time.time()
+                self._index['hits'] += 1
+            self._save_index()
+        return entry is not None
+
+    def store(self, key, src_path, link=False):
+        """把完成的输出文件（或片段）存入缓存，并按容量淘汰最久未使用的条目"""
+        file_name = key + os.path.splitext(src_path)[1]
+        cached_path = os.path.join(self.cache_dir, file_name)
+        _place_file(src_path, cached_path, link)
+        with self._lock:
+            self._index['entries'][key] = {
+                'file': file_name,
+                'size': os.path.getsize(cached_path),
+                'last_access': time.time(),
+            }
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        entries = self._index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            entry = entries.pop(key)
+            total -= entry['size']
+            try:
+                os.remove(os.path.join(self.cache_dir, entry['file']))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            entries = self._index['entries']
+            hits, misses = self._index['hits'], self._index['misses']
+            return {
+                'entries': len(entries),
+                'bytes': sum(entry['size'] for entry in entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_result_cache(cache_dir, max_bytes):
+    """同一进程内同一缓存目录共用一个实例，并发任务不会互相覆盖索引"""
+    cache_dir = os.path.abspath(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = _caches[cache_dir] = ResultCache(cache_dir, max_bytes)
+        cache.max_bytes = max_bytes
+        return cache
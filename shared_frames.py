@@ -0,0 +1,98 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _attach(name):
+    """在子进程中附加到已有的共享内存
+
+    进程池的子进程与主进程共用同一个 resource tracker，重复登记不会产生副作用，
+    共享内存始终由主进程在 SharedFrameRing.close() 中删除。
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameRing:
+    """预分配的共享内存帧环形缓冲区
+
+    每个槽位包含一块输入帧 (H x W x 3) 和一块输出帧，主进程把解码后的帧写入
+    输入槽，子进程原地读取并把结果写回输出槽，帧数据本身不经过 pickle。
+    """
+
+    def __init__(self, num_slots, input_shape, output_shape, dtype=np.uint8):
+        self.num_slots = num_slots
+        self.input_shape = tuple(input_shape)
+        self.output_shape = tuple(output_shape)
+        self.dtype = np.dtype(dtype)
+        self._input_shm = shared_memory.SharedMemory(
+            create=True, size=num_slots * self._nbytes(self.input_shape))
+        self._output_shm = shared_memory.SharedMemory(
+            create=True, size=num_slots * self._nbytes(self.output_shape))
+        self.inputs = self._view(self._input_shm, self.input_shape)
+        self.outputs = self._view(self._output_shm, self.output_shape)
+        self._free = list(range(num_slots))
+
+    def _nbytes(self, shape):
+        return int(np.prod(shape)) * self.dtype.itemsize
+
+    def _view(self, shm, shape):
+        return np.ndarray((self.num_slots,) + shape, dtype=self.dtype, buffer=shm.buf)
+
+    def spec(self):
+        """子进程附加到缓冲区所需的描述信息（可 pickle）"""
+        return {
+            'input_name': self._input_shm.name,
+            'output_name': self._output_shm.name,
+            'num_slots': self.num_slots,
+            'input_shape': self.input_shape,
+            'output_shape': self.output_shape,
+            'dtype': self.dtype.str,
+        }
+
+    def acquire(self, frame):
+        """占用一个空闲槽位并拷入输入帧，返回槽位编号"""
+        if frame.shape != self.input_shape:
+            raise ValueError(f"帧尺寸 {frame.shape} 与共享缓冲区 {self.input_shape} 不一致")
+        if not self._free:
+            raise RuntimeError("共享帧缓冲区没有空闲槽位")
+        slot = self._free.pop()
+        np.copyto(self.inputs[slot], frame)
+        return slot
+
+    def release(self, slot):
+        self._free.append(slot)
+
+    def close(self):
+        """释放并删除共享内存"""
+        self.inputs = self.outputs = None
+        for shm in (self._input_shm, self._output_shm):
+            shm.close()
+            shm.unlink()
+
+
+class SharedFrameWorker:
+    """子进程一侧的共享帧处理入口"""
+
+    def __init__(self, spec, processor):
+        self.processor = processor
+        dtype = np.dtype(spec['dtype'])
+        self._input_shm = _attach(spec['input_name'])
+        self._output_shm = _attach(spec['output_name'])
+        self.inputs = np.ndarray((spec['num_slots'],) + tuple(spec['input_shape']),
+                                 dtype=dtype, buffer=self._input_shm.buf)
+        self.outputs = np.ndarray((spec['num_slots'],) + tuple(spec['output_shape']),
+                                  dtype=dtype, buffer=self._output_shm.buf)
+
+    def __call__(self, slot):
+        """处理一个槽位，返回 (耗时, 各步骤耗时或 None)"""
+        start = time.perf_counter()
+        steps = None
+        if getattr(self.processor, 'stage_timing', False):
+            result, steps = self.processor.timed_call(self.inputs[slot])
+        else:
+            result = self.processor(self.inputs[slot])
+        if result.shape != self.outputs[slot].shape:
+            raise ValueError(f"处理结果尺寸 {result.shape} 与输出槽 {self.outputs[slot].shape} 不一致")
+        np.copyto(self.outputs[slot], result)
+        return time.perf_counter() - start, steps
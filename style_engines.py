@@ -0,0 +1,415 @@
+import threading
+
+import cv2
+import numpy as np
+
+# 风格名称 -> 工厂函数 factory(params, use_gpu)，返回编译好的 StyleEngine
+STYLE_REGISTRY = {}
+
+
+def register_style(name):
+    """注册风格的装饰器，被装饰的类或函数以 (params, use_gpu) 调用"""
+    def decorator(factory):
+        STYLE_REGISTRY[name] = factory
+        return factory
+    return decorator
+
+
+def available_styles():
+    return list(STYLE_REGISTRY)
+
+
+def compile_style(style, params, use_gpu=False):
+    """把风格和参数编译为逐帧调用的引擎，每个任务只需编译一次"""
+    factory = STYLE_REGISTRY.get(style)
+    if factory is None:
+        raise ValueError(f"不支持的风格: {style}")
+    return factory(params, use_gpu)
+
+
+def cartoon_kernel_size(strength):
+    """卡通风格自适应阈值邻域和双边滤波直径（奇数）"""
+    kernel_size = int(9 * (1 + strength))
+    if kernel_size % 2 == 0:
+        kernel_size += 1
+    return kernel_size
+
+
+def sketch_kernel_size(strength):
+    """素描风格高斯模糊的核大小（奇数）"""
+    kernel_size = int(21 * (1 + strength))
+    if kernel_size % 2 == 0:
+        kernel_size += 1
+    return kernel_size
+
+
+class StyleEngine:
+    """编译后的风格：由强度等参数推导的常量、查找表在构造时算好，逐帧只做计算
+
+    工作缓冲区按线程和尺寸预分配，同一分辨率的后续帧直接复用；输出写入调用方
+    传入的 out（与输入帧同尺寸，例如帧缓冲区池中的缓冲区），未传入时每次新分配，
+    调用方可以安全地持有。强度为 0 等恒等情况下可能直接返回输入帧而不写 out。
+
+    分块处理相关的属性：halo 为滤波器影响半径（为 0 表示不能分块，整帧处理）；
+    块的起点需要对齐到 align 的整数倍。需要整帧统计量的风格另外提供
+    local(frame) / finish(frame, partial) 两段接口，local 返回单通道 uint8 的中间结果。
+
+    upscale_after 为 True 时，放大输出的任务先在原分辨率风格化再放大（滤波的像素
+    更少）；效果依赖最终像素尺度的风格设为 False，先放大再风格化。
+    """
+
+    halo = 0
+    align = 1
+    upscale_after = True
+
+    def __init__(self, params, use_gpu=False):
+        self.strength = params['strength'] / 100.0
+        self.use_gpu = use_gpu
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _buffer(self, name, shape):
+        # 分块处理时块的尺寸只有少数几种，按 (名称, 尺寸) 缓存避免反复分配
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        key = (name, shape)
+        buffer = buffers.get(key)
+        if buffer is None:
+            buffer = buffers[key] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def __call__(self, frame, out=None):
+        return frame
+
+    def process_batch(self, frames):
+        """处理一批帧，可以跨帧向量化的风格重写此方法"""
+        return [self(frame) for frame in frames]
+
+
+class StylizationEngine(StyleEngine):
+    """基于 cv2.stylization（边缘保持滤波）的风格，sigma_s / sigma_r 随强度变化"""
+
+    sigma_s_base = 60
+    sigma_r_base = 0.6
+
+    def __init__(self, params, use_gpu=False):
+        super().__init__(params, use_gpu)
+        self.sigma_s = int(self.sigma_s_base * (1 + self.strength))
+        self.sigma_r = self.sigma_r_base * self.strength
+        # 递归滤波，重叠取 1.5 倍 sigma_s 时分块误差在 1-2 个灰度级内
+        self.halo = self.sigma_s * 3 // 2
+
+    def __call__(self, frame, out=None):
+        if self.use_gpu:
+            gpu_frame = cv2.cuda_GpuMat()
+            gpu_frame.upload(frame)
+            gpu_result = cv2.cuda.stylization(gpu_frame)
+            return gpu_result.download()
+        return cv2.stylization(frame, out, sigma_s=self.sigma_s, sigma_r=self.sigma_r)
+
+
+@register_style('油画风格')
+class OilPaintingEngine(StylizationEngine):
+    sigma_s_base = 60
+    sigma_r_base = 0.6
+
+
+@register_style('水彩风格')
+class WatercolorEngine(StylizationEngine):
+    sigma_s_base = 100
+    sigma_r_base = 0.3
+
+
+def bilateral_cartoon(frame, kernel_size, use_gpu=False):
+    """卡通风格的原始实现：原分辨率双边滤波，GPU 路径和保真度对比使用"""
+    if use_gpu:
+        gpu_frame = cv2.cuda_GpuMat()
+        gpu_frame.upload(frame)
+        gpu_gray = cv2.cuda.cvtColor(gpu_frame, cv2.COLOR_BGR2GRAY)
+        gray = gpu_gray.download()
+    else:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                  cv2.THRESH_BINARY, kernel_size, kernel_size)
+
+    if use_gpu:
+        gpu_color = cv2.cuda.bilateralFilter(gpu_frame, kernel_size, 300, 300)
+        color = gpu_color.download()
+    else:
+        color = cv2.bilateralFilter(frame, kernel_size, 300, 300)
+
+    return cv2.bitwise_and(color, color, mask=edges)
+
+
+@register_style('卡通/动漫风格')
+class CartoonEngine(StyleEngine):
+    """卡通/动漫风格
+
+    边缘掩码与原实现相同，在原分辨率上用自适应阈值计算。色块平滑原来是直径最大 19
+    的双边滤波，这里先 INTER_AREA 缩小一半、直径减半做双边滤波再放大，快 10-15 倍。
+    缩小会损失文字和锐利边缘附近的细节：在 lavfi testsrc2 测试图上与原输出的 PSNR
+    在 720p 约 39 dB、1080p 约 41 dB，更小的帧低于 38 dB，因此像素数少于
+    reduce_min_pixels 的帧在原分辨率上滤波（结果与原实现相同）。GPU 上仍使用原实现。
+    """
+
+    factor = 2
+    align = 2
+    # 整帧像素数达到该值（720p）时才缩小滤波
+    reduce_min_pixels = 1280 * 720
+
+    def __init__(self, params, use_gpu=False):
+        super().__init__(params, use_gpu)
+        self.kernel_size = cartoon_kernel_size(self.strength)
+        self.filter_size = max(3, (self.kernel_size // self.factor) | 1)
+        self.sigma_space = 300 / self.factor
+        # adaptiveThreshold 的邻域和 bilateralFilter 的直径都是 kernel_size，另加缩放插值的几个像素
+        self.halo = self.kernel_size + 8
+
+    def reduces(self, height, width):
+        """整帧尺寸为 (height, width) 时是否缩小滤波；分块处理时按整帧决定，各块一致"""
+        return height * width >= self.reduce_min_pixels
+
+    def _smooth(self, frame, reduce):
+        """缩小 -> 双边滤波 -> 放大，返回线程内复用的缓冲区；reduce 为 False 时按原实现整帧滤波
+
+        只对尺寸为 factor 整数倍的部分做整数倍缩放，余下不足一个采样块的行列
+        复制最后一行/列，这样任意位置起点对齐的子区域都与整帧的采样网格一致。
+        """
+        height, width = frame.shape[:2]
+        factor = self.factor
+        if not reduce or height < factor or width < factor:
+            return cv2.bilateralFilter(frame, self.kernel_size, 300, 300)
+        small_width, small_height = width // factor, height // factor
+        fitted_width, fitted_height = small_width * factor, small_height * factor
+        small = self._buffer('small', (small_height, small_width, 3))
+        smoothed = self._buffer('smoothed', small.shape)
+        color = self._buffer('color', frame.shape)
+        cv2.resize(frame[:fitted_height, :fitted_width], (small_width, small_height), dst=small,
+                   interpolation=cv2.INTER_AREA)
+        cv2.bilateralFilter(small, self.filter_size, 300, self.sigma_space, dst=smoothed)
+        fitted = color[:fitted_height, :fitted_width]
+        cv2.resize(smoothed, (fitted_width, fitted_height), dst=fitted, interpolation=cv2.INTER_LINEAR)
+        color[:, fitted_width:] = color[:, fitted_width - 1:fitted_width]
+        color[fitted_height:] = color[fitted_height - 1:fitted_height]
+        return color
+
+    def __call__(self, frame, out=None, reduce=None):
+        if self.use_gpu:
+            return bilateral_cartoon(frame, self.kernel_size, use_gpu=True)
+        height, width = frame.shape[:2]
+        if reduce is None:
+            reduce = self.reduces(height, width)
+        gray = self._buffer('gray', (height, width))
+        edges = self._buffer('edges', (height, width))
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                              self.kernel_size, self.kernel_size, dst=edges)
+
+        color = self._smooth(frame, reduce)
+
+        # 掩码外的像素保持为 0；新分配时 np.zeros 由系统按需清零，比先填充再遮罩更快
+        if out is None:
+            output = np.zeros(frame.shape, dtype=np.uint8)
+        else:
+            output = out
+            output.fill(0)
+        cv2.bitwise_and(color, color, dst=output, mask=edges)
+        return output
+
+
+def sketch_gray(frame, strength, use_gpu=False):
+    """素描风格的局部部分：灰度图除以反相模糊图，结果尚未做对比度拉伸"""
+    # 获取原始图像的灰度版本
+    if use_gpu:
+        gpu_frame = cv2.cuda_GpuMat()
+        gpu_frame.upload(frame)
+        gpu_gray = cv2.cuda.cvtColor(gpu_frame, cv2.COLOR_BGR2GRAY)
+        gray = gpu_gray.download()
+    else:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    # 创建素描效果
+    kernel_size = sketch_kernel_size(strength)
+
+    # 反转图像
+    inverted = 255 - gray
+
+    # 创建高斯模糊效果
+    if use_gpu:
+        gpu_inverted = cv2.cuda_GpuMat()
+        gpu_inverted.upload(inverted)
+        gpu_blurred = cv2.cuda.GaussianBlur(gpu_inverted, (kernel_size, kernel_size), 0)
+        blurred = gpu_blurred.download()
+    else:
+        blurred = cv2.GaussianBlur(inverted, (kernel_size, kernel_size), 0)
+
+    # 再次反转并进行除法运算
+    inverted_blurred = 255 - blurred
+    return cv2.divide(gray, inverted_blurred, scale=256.0)
+
+
+def finish_sketch(frame, sketch, strength):
+    """素描风格的全局部分：整帧对比度拉伸、转三通道并按强度混合原始颜色"""
+    # 增强对比度
+    sketch = cv2.normalize(sketch, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+
+    # 将素描效果转换为3通道图像
+    sketch_bgr = cv2.cvtColor(sketch.astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+    # 可选：保持一些原始颜色信息
+    if strength < 0.8:  # 当强度较低时，混合一些原始颜色
+        alpha = 1 - strength  # 原始颜色的权重
+        sketch_colored = cv2.addWeighted(frame, alpha, sketch_bgr, 1 - alpha, 0)
+        return sketch_colored
+
+    return sketch_bgr
+
+
+@register_style('素描风格')
+class SketchEngine(StyleEngine):
+    """素描风格，与 sketch_gray + finish_sketch 的结果逐位一致
+
+    反相、模糊、除法和对比度拉伸都写入预分配的缓冲区，整帧只分配输出这一次。
+    对比度拉伸需要整帧的最值，分块处理时先对各块调用 local，拼接后整帧调用 finish。
+    """
+
+    def __init__(self, params, use_gpu=False):
+        super().__init__(params, use_gpu)
+        self.kernel_size = sketch_kernel_size(self.strength)
+        self.halo = self.kernel_size // 2 + 1
+
+    def local(self, frame):
+        """灰度图除以反相模糊图，返回线程内复用的缓冲区，尚未做对比度拉伸"""
+        if self.use_gpu:
+            return sketch_gray(frame, self.strength, use_gpu=True)
+        shape = frame.shape[:2]
+        gray = self._buffer('gray', shape)
+        blurred = self._buffer('blurred', shape)
+        sketch = self._buffer('sketch', shape)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        cv2.bitwise_not(gray, dst=sketch)
+        cv2.GaussianBlur(sketch, (self.kernel_size, self.kernel_size), 0, dst=blurred)
+        cv2.bitwise_not(blurred, dst=blurred)
+        cv2.divide(gray, blurred, dst=sketch, scale=256.0)
+        return sketch
+
+    def finish(self, frame, sketch, out=None):
+        """整帧对比度拉伸、转三通道并按强度混合原始颜色（会原地修改 sketch）"""
+        cv2.normalize(sketch, sketch, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+        output = np.empty(frame.shape, dtype=np.uint8) if out is None else out
+        cv2.cvtColor(sketch, cv2.COLOR_GRAY2BGR, dst=output)
+        if self.strength < 0.8:
+            alpha = 1 - self.strength
+            cv2.addWeighted(frame, alpha, output, 1 - alpha, 0, dst=output)
+        return output
+
+    def __call__(self, frame, out=None):
+        return self.finish(frame, self.local(frame), out)
+
+
+# 经典棕褐色矩阵（行：输出 B/G/R，列：输入 B/G/R）
+SEPIA_MATRIX = np.array([
+    [0.131, 0.534, 0.272],
+    [0.168, 0.686, 0.349],
+    [0.189, 0.769, 0.393],
+], dtype=np.float32)
+
+
+@register_style('复古滤镜')
+class VintageEngine(StyleEngine):
+    """复古滤镜：棕褐色调 + 褪色色调曲线 + 暗角
+
+    颜色矩阵、色调查找表在编译时按强度算好，暗角遮罩按分辨率生成一次；
+    每帧只需一次 cv2.transform、一次 cv2.LUT 和一次乘法。暗角与像素位置有关，
+    不能分块处理。
+    """
+
+    def __init__(self, params, use_gpu=False):
+        super().__init__(params, use_gpu)
+        strength = self.strength
+        self.matrix = (1 - strength) * np.eye(3, dtype=np.float32) + strength * SEPIA_MATRIX
+        # 抬高黑位、压低白位，模拟褪色的老照片
+        low, high = 40 * strength, 255 - 20 * strength
+        values = np.arange(256, dtype=np.float32)
+        self.tone_lut = np.clip(low + values * (high - low) / 255, 0, 255).astype(np.uint8)
+        self.vignette = 0.6 * strength
+        self._masks = {}
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_masks'] = {}
+        return state
+
+    def _vignette_mask(self, height, width):
+        """按分辨率缓存的三通道暗角遮罩（0-255），中心为 255"""
+        key = (height, width)
+        mask = self._masks.get(key)
+        if mask is None:
+            y = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+            x = np.linspace(-1, 1, width, dtype=np.float32)[None, :]
+            falloff = 1 - self.vignette * np.clip((x * x + y * y) / 2, 0, 1)
+            gray = np.round(falloff * 255).astype(np.uint8)
+            # 多个线程同时生成时结果相同，后写入的覆盖即可
+            mask = self._masks[key] = cv2.merge([gray, gray, gray])
+        return mask
+
+    def _tone(self, image, out=None):
+        """颜色矩阵 + 色调曲线，可以一次处理整批帧拼成的大图"""
+        toned = cv2.transform(image, self.matrix, out)
+        cv2.LUT(toned, self.tone_lut, dst=toned)
+        return toned
+
+    def _apply_vignette(self, frame):
+        if self.vignette > 0:
+            mask = self._vignette_mask(*frame.shape[:2])
+            cv2.multiply(frame, mask, dst=frame, scale=1 / 255)
+        return frame
+
+    def __call__(self, frame, out=None):
+        if self.strength == 0:
+            return frame
+        return self._apply_vignette(self._tone(frame, out))
+
+    def process_batch(self, frames):
+        """同尺寸的一批帧纵向拼成一张大图，颜色矩阵和查找表各只调用一次"""
+        if self.strength == 0 or len({frame.shape for frame in frames}) != 1:
+            return super().process_batch(frames)
+        height = frames[0].shape[0]
+        toned = self._tone(np.concatenate(frames, axis=0))
+        return [self._apply_vignette(toned[i * height:(i + 1) * height])
+                for i in range(len(frames))]
+
+
+@register_style('自定义风格')
+class DetailEngine(StyleEngine):
+    """自定义风格：不做艺术化处理，只保留饱和度/亮度/尺寸等基础调整，
+    强度控制反锐化掩模的细节增强程度。
+
+    其他效果可以用 register_style 注册新的风格引擎实现。
+    """
+
+    # 锐化要作用在最终分辨率的像素上，放大后再锐化
+    upscale_after = False
+
+    def __init__(self, params, use_gpu=False):
+        super().__init__(params, use_gpu)
+        self.amount = 1.5 * self.strength
+        self.sigma = 1.0 + 2.0 * self.strength
+        self.halo = int(3 * self.sigma) + 2
+
+    def __call__(self, frame, out=None):
+        if self.amount == 0:
+            return frame
+        blurred = self._buffer('blurred', frame.shape)
+        cv2.GaussianBlur(frame, (0, 0), self.sigma, dst=blurred)
+        return cv2.addWeighted(frame, 1 + self.amount, blurred, -self.amount, 0, dst=out)
@@ -0,0 +1,473 @@
+import cv2
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from checkpoint import OUTPUT_OPTIONS, JobCheckpoint, SegmentedWriter, job_fingerprint
+from chunked import ChunkedRenderer
+from ffmpeg_io import (AudioDemuxer, FFmpegWriter, audio_copy_compatible, concat_segments,
+                       ffmpeg_available, ffprobe_available, probe_audio_codec)
+from frame_ops import FrameProcessor, adjust_image, apply_style, compile_pipeline, resize_frame
+from frame_pipeline import FramePipeline, ProcessingCancelled
+from frame_pool import FramePool, queue_size_for_memory
+from frame_sources import open_frame_source, resolve_decoder
+from metrics import JobMetrics
+from progress import ProgressTracker
+from result_cache import open_result_cache, result_key, source_fingerprint
+from temporal import make_skipper
+from tiling import TiledStyler
+
+# 处理方式相关的选项，与影响画面效果的 params 分开保存
+DEFAULT_OPTIONS = {
+    'execution_mode': 'thread',  # 'serial' / 'thread' / 'process'
+    'num_workers': None,  # 为 None 时使用 CPU 核数 - 1
+    'queue_size': None,  # 解码队列与在途帧上限，为 None 时按 memory_limit 和帧大小计算
+    'memory_limit': 2 * 1024 ** 3,  # 帧缓冲区（预读队列、在途帧和中间结果）的内存上限（字节）
+    'decoder': 'auto',  # 'ffmpeg' rawvideo 管道解码 / 'opencv' VideoCapture；'auto' 有 ffmpeg 和 ffprobe 时用管道
+    'encoder': 'auto',  # 'ffmpeg' 管道编码 / 'opencv' VideoWriter + 音频合并；'auto' 有 ffmpeg 时用管道
+    'video_codec': 'libx264',  # ffmpeg 编码器
+    'preset': 'medium',  # libx264 编码速度预设
+    'crf': 23,  # libx264 质量，越小质量越高
+    'preview_max_fps': 5,  # 预览帧的最高发送频率
+    'preview_size': (640, 360),  # 预览帧的最大尺寸，通常由界面按预览控件大小设置
+    'chunks': 0,  # 大于 1 时按关键帧分块，各块在独立进程中并行处理（需要 ffmpeg 和 ffprobe）
+    'chunk_retries': 2,  # 失败分块的自动重试次数
+    'work_dir': None,  # 分块/续传的工作目录，默认为 输出路径 + '.chunks' / '.work'
+    'resumable': False,  # 按片段编码并记录检查点，中断后重新运行同一任务可继续（需要 ffmpeg）
+    'segment_frames': 1500,  # 续传模式下每个片段的帧数
+    'tile_size': 0,  # 大于 0 时把超过该边长的帧切成带重叠的块并行风格化，限制 4K/8K 帧的内存占用
+    'temporal_threshold': 0,  # 大于 0 时启用时域跳帧：与参考帧各区块的灰度差（0-255）都低于该值时复用上一帧结果
+    'temporal_max_reuse': 30,  # 时域跳帧时最多连续复用的帧数
+    'cache_dir': None,  # 结果缓存目录，相同源文件、风格和参数的任务直接复用输出；为 None 时不缓存
+    'cache_max_bytes': 10 * 1024 ** 3,  # 结果缓存的容量上限，超出时淘汰最久未使用的条目
+    'metrics': False,  # 额外记录缩放/调整/风格化各步骤的耗时；解码、处理、编码和队列深度始终记录
+    'metrics_path': None,  # 任务结束时写出指标文件，.json 为 JSON，其余扩展名为 Prometheus 文本格式
+    'metrics_interval': 1.0,  # on_metrics 回调的最小间隔（秒）
+}
+
+
+class VideoStylizer:
+    """视频风格化处理核心，不依赖 Qt
+
+    进度、预览和完成事件通过回调通知：on_progress(int)、on_preview(frame)、
+    on_finished()。on_preview 为 None 时不生成预览帧。处理过程中按 metrics_interval
+    回调 on_metrics(dict)，内容为 JobMetrics.snapshot()。剩余时间通过
+    on_eta(已完成帧数, 平滑吞吐 fps, 剩余秒数) 通知，剩余时间未知时为 -1。
+    """
+
+    def __init__(self, video_path, style, params=None, options=None,
+                 on_progress=None, on_preview=None, on_finished=None, on_metrics=None,
+                 on_eta=None):
+        self.video_path = video_path
+        self.style = style
+        self.params = params or {
+            'strength': 50,
+            'saturation': 0,
+            'brightness': 0,
+            'scale_factor': 1.0  # 新增缩放参数
+        }
+        # 使用时间戳创建唯一的临时文件名，附加随机后缀避免并发任务冲突
+        timestamp = f'{int(time.time())}_{uuid.uuid4().hex[:8]}'
+        self.temp_video_path = f'temp_video_{timestamp}.mp4'
+        self.temp_audio_path = f'temp_audio_{timestamp}.mka'
+        
+        # 检查是否支持 CUDA
+        self.use_gpu = cv2.cuda.getCudaEnabledDeviceCount() > 0
+        if self.use_gpu:
+            print("启用 GPU 加速")
+        
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+
+        # 设置处理线程数
+        self.num_workers = self.options['num_workers'] or max(1, multiprocessing.cpu_count() - 1)
+        self.pipeline_stats = None
+        self.preview_size = self.options['preview_size']
+        self._last_preview_time = 0.0
+        self.on_progress = on_progress
+        self.on_preview = on_preview
+        self.on_finished = on_finished
+        self.on_metrics = on_metrics
+        self.on_eta = on_eta
+        self.progress = None
+        self.metrics = JobMetrics()
+        self._last_metrics_time = 0.0
+        self._cancel_event = threading.Event()
+        self.cache_stats = None
+        self.skip_ratio = None
+
+    def start_audio(self, output_path, checkpoint=None):
+        """任务开始时在后台提取音轨，返回 AudioDemuxer；不需要单独提取时返回 None
+
+        流式编码器直接从源文件映射音频，不需要提取；续传模式的音轨放在工作目录中，
+        最后拼接片段时混入；其余情况写临时音频文件，与临时视频合并。
+        """
+        if not ffmpeg_available():
+            return None
+        if checkpoint is not None:
+            audio_path = os.path.join(checkpoint.work_dir, 'audio.mka')
+        elif self.use_streaming_encoder():
+            return None
+        else:
+            audio_path = self.temp_audio_path
+        return AudioDemuxer(self.video_path, output_path, audio_path).start()
+
+    def wait_audio(self, demuxer):
+        """等待后台提取的音轨，返回其路径，没有音频时返回 None"""
+        if demuxer is None:
+            return None
+        with self.metrics.timed('audio_wait'):
+            audio_path = demuxer.wait()
+        self.metrics.stage('audio_extract').add(demuxer.elapsed)
+        return audio_path
+
+    def merge_audio_video(self, video_path, audio_path, output_path):
+        """合并视频和音频，音轨已由 AudioDemuxer 转为输出容器兼容的编码，直接复制"""
+        cmd = ['ffmpeg', '-i', video_path, '-i', audio_path,
+               '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+               output_path, '-y']
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+            return True
+        except subprocess.CalledProcessError:
+            print("音视频合并失败")
+            return False
+
+    def cleanup_temp_files(self):
+        """清理临时文件"""
+        temp_files = [self.temp_video_path, self.temp_audio_path]
+        for file in temp_files:
+            if os.path.exists(file):
+                try:
+                    os.remove(file)
+                except Exception as e:
+                    print(f"清理临时文件失败: {str(e)}")
+
+    def resize_frame(self, frame, scale_factor):
+        """调整帧的大小"""
+        return resize_frame(frame, scale_factor, self.use_gpu)
+
+    def process_frame_batch(self, frames):
+        """处理一批帧"""
+        return FrameProcessor(self.style, self.params, self.use_gpu).process_batch(frames)
+
+    def adjust_image(self, frame):
+        """应用亮度和饱和度调整"""
+        return adjust_image(frame, self.params, self.use_gpu)
+
+    def apply_style(self, frame):
+        """应用风格化效果"""
+        return apply_style(frame, self.style, self.params, self.use_gpu)
+
+    def set_preview_size(self, width, height):
+        """设置预览帧的最大尺寸（一般为预览控件的大小）"""
+        self.preview_size = (width, height)
+
+    def cancel(self):
+        """请求协作式中止：停止读取新帧，写完已提交的帧后结束
+
+        续传模式下当前片段会被提交，下次运行同一任务时从这里继续。
+        """
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def report_progress(self, progress):
+        if self.on_progress is not None:
+            self.on_progress(progress)
+
+    def report_eta(self, tracker):
+        remaining = tracker.remaining
+        if self.on_eta is not None:
+            self.on_eta(tracker.frames_done, tracker.fps, -1.0 if remaining is None else remaining)
+
+    def emit_preview(self, frame, force=False):
+        """按频率限制发送预览帧"""
+        if self.on_preview is None:
+            return
+        max_fps = self.options['preview_max_fps']
+        now = time.monotonic()
+        if not force and max_fps and now - self._last_preview_time < 1.0 / max_fps:
+            return
+        self._last_preview_time = now
+        self.on_preview(frame)
+
+    def emit_metrics(self, force=False):
+        """按 metrics_interval 限制频率回调当前指标"""
+        if self.on_metrics is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_metrics_time < self.options['metrics_interval']:
+            return
+        self._last_metrics_time = now
+        self.on_metrics(self.metrics.snapshot())
+
+    def write_metrics(self):
+        """写出指标文件（设置了 metrics_path 时）并回调最终指标"""
+        if self.options['metrics_path']:
+            try:
+                self.metrics.write(self.options['metrics_path'])
+            except OSError as e:
+                print(f"写入指标文件失败: {str(e)}")
+        self.emit_metrics(force=True)
+
+    def use_streaming_encoder(self):
+        """是否通过 ffmpeg 管道直接编码输出"""
+        encoder = self.options['encoder']
+        if encoder == 'auto':
+            return ffmpeg_available()
+        return encoder == 'ffmpeg'
+
+    def use_chunks(self):
+        """是否分块并行处理，需要 ffmpeg 和 ffprobe"""
+        return self.options['chunks'] > 1 and ffmpeg_available() and ffprobe_available()
+
+    def output_options(self):
+        """影响输出内容的选项，用于续传指纹和结果缓存键
+
+        decoder 为实际使用的解码器：分块处理总是用 ffmpeg 管道，'auto' 按环境解析。
+        """
+        options = {name: self.options[name] for name in OUTPUT_OPTIONS}
+        options['decoder'] = 'ffmpeg' if self.use_chunks() else resolve_decoder(self.options['decoder'])
+        return options
+
+    def create_pipeline(self, input_shape, pool=None, plan=None):
+        """按处理选项创建帧流水线
+
+        启用分块风格化时，核数主要用于块级并行，帧级只保留两个在途帧以保持
+        解码、处理和编码重叠；进程模式下各进程平分块级线程。未指定 queue_size 时
+        按输入帧尺寸 input_shape 和 memory_limit 计算队列上限，4K/8K 下自动减小。
+        pool 为帧源使用的帧缓冲区池，处理器和流水线共用；plan 为帧源的分辨率安排。
+        """
+        frame_workers = self.num_workers
+        style_fn = None
+        if self.options['tile_size']:
+            frame_workers = min(2, self.num_workers)
+            tile_workers = self.num_workers
+            if self.options['execution_mode'] == 'process':
+                tile_workers = max(1, self.num_workers // frame_workers)
+            style_fn = TiledStyler(self.style, self.params, self.use_gpu,
+                                   tile_size=self.options['tile_size'], num_workers=tile_workers)
+        processor = FrameProcessor(self.style, self.params, self.use_gpu, style_fn,
+                                   stage_timing=self.options['metrics'], pool=pool, plan=plan)
+        queue_size = self.options['queue_size'] or queue_size_for_memory(
+            input_shape, processor.output_shape(input_shape), self.options['memory_limit'],
+            frame_workers)
+        pipeline = FramePipeline(processor, frame_workers,
+                                 mode=self.options['execution_mode'],
+                                 queue_size=queue_size,
+                                 skipper=make_skipper(self.options), pool=pool)
+        self.metrics.attach(pipeline)
+        return pipeline
+
+    def open_checkpoint(self, output_path):
+        """打开（或恢复）续传模式的任务工作目录"""
+        work_dir = self.options['work_dir'] or output_path + '.work'
+        fingerprint = job_fingerprint(self.video_path, self.style, self.params, self.output_options())
+        return JobCheckpoint(work_dir, fingerprint)
+
+    def open_result_cache(self, output_path):
+        """打开结果缓存并计算本任务的缓存键，未启用缓存时返回 (None, None)"""
+        if not self.options['cache_dir']:
+            return None, None
+        cache = open_result_cache(self.options['cache_dir'], self.options['cache_max_bytes'])
+        extra = self.output_options()
+        extra['container'] = os.path.splitext(output_path)[1].lower()
+        key = result_key(source_fingerprint(self.video_path), self.style, self.params, extra)
+        return cache, key
+
+    def finish(self, output_path, cache=None, cache_key=None):
+        """输出完成：存入结果缓存并通知"""
+        if cache is not None:
+            cache.store(cache_key, output_path)
+            self.cache_stats = cache.stats()
+        self.write_metrics()
+        self.report_progress(100)
+        print(f'视频已保存到 {output_path}')
+        if self.on_finished is not None:
+            self.on_finished()
+
+    def fetch_cached_result(self, output_path, cache, cache_key):
+        """结果缓存命中时直接复制输出，返回是否命中"""
+        if cache is None or not cache.fetch(cache_key, output_path):
+            return False
+        self.cache_stats = cache.stats()
+        print(f"命中结果缓存，跳过处理 (命中率 {self.cache_stats['hit_rate']:.0%})")
+        self.finish(output_path)
+        return True
+
+    def open_writer(self, output_path, width, height, fps, checkpoint=None):
+        """创建帧写入器：ffmpeg 管道直接写出最终文件，否则写临时视频文件
+
+        传入 checkpoint 时按片段写入工作目录，音频在最后拼接时混入。
+        """
+        if checkpoint is not None:
+            def open_segment(path):
+                return FFmpegWriter(path, width, height, fps,
+                                    codec=self.options['video_codec'],
+                                    preset=self.options['preset'],
+                                    crf=self.options['crf'])
+            return SegmentedWriter(checkpoint, open_segment, self.options['segment_frames'])
+        if self.use_streaming_encoder():
+            audio_codec = probe_audio_codec(self.video_path)
+            return FFmpegWriter(output_path, width, height, fps,
+                                audio_source=self.video_path,
+                                audio_copy=audio_copy_compatible(audio_codec, output_path),
+                                codec=self.options['video_codec'],
+                                preset=self.options['preset'],
+                                crf=self.options['crf'])
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        return cv2.VideoWriter(self.temp_video_path, fourcc, fps, (width, height))
+
+    def process_video_chunked(self, output_path, cache=None, cache_key=None):
+        """分块并行处理视频"""
+        try:
+            renderer = ChunkedRenderer(self.video_path, self.style, self.params, self.options,
+                                       use_gpu=self.use_gpu, num_workers=self.num_workers,
+                                       on_progress=self.report_progress,
+                                       cache=cache, cache_key=cache_key, metrics=self.metrics,
+                                       on_eta=self.report_eta, output_options=self.output_options())
+            renderer.render(output_path, self.options['work_dir'], cancel_event=self._cancel_event)
+        except ProcessingCancelled:
+            print("处理已取消，已完成的分块保留在工作目录中")
+            self.write_metrics()
+            raise
+        except Exception as e:
+            print(f"处理视频时出错: {str(e)}")
+            self.write_metrics()
+            raise e
+        self.finish(output_path, cache, cache_key)
+
+    def process_video(self, output_path):
+        """处理视频并直接保存到指定路径"""
+        cache, cache_key = self.open_result_cache(output_path)
+        if self.fetch_cached_result(output_path, cache, cache_key):
+            return
+        if self.use_chunks():
+            return self.process_video_chunked(output_path, cache, cache_key)
+        if self.options['chunks'] > 1:
+            print("分块处理需要 ffmpeg 和 ffprobe，改为不分块处理")
+        source = None
+        out = None
+        demuxer = None
+        try:
+            checkpoint = self.open_checkpoint(output_path) if self.options['resumable'] else None
+            start_frame = checkpoint.next_frame if checkpoint is not None else 0
+            if start_frame:
+                print(f"从第 {start_frame} 帧继续处理")
+            # 音轨提取与视频处理同时进行
+            demuxer = self.start_audio(output_path, checkpoint)
+            pool = FramePool()
+            engine = compile_pipeline(self.style, self.params, self.use_gpu).engine
+            source = open_frame_source(self.video_path, self.options['decoder'],
+                                       pool=pool, start_frame=start_frame,
+                                       scale_factor=self.params.get('scale_factor', 1.0),
+                                       upscale_after=engine.upscale_after)
+            pipeline = self.create_pipeline(source.frame_shape, pool, source.plan)
+            fps = source.fps
+            tracker = ProgressTracker(source.frame_count, source.duration, source.frame_count_exact,
+                                      start_frame=start_frame)
+            self.progress = tracker
+
+            # 创建视频写入器，处理器的输出已经是分辨率安排中的输出尺寸
+            frame_width, frame_height = source.plan.output_size
+            out = self.open_writer(output_path, frame_width, frame_height, fps, checkpoint)
+
+            # 没有预览回调时完全跳过预览帧的生成
+            preview_enabled = self.on_preview is not None
+
+            def on_frame(index, processed_frame):
+                current_frame = start_frame + index + 1
+                self.emit_metrics()
+                # 发送当前帧作为预览
+                if preview_enabled:
+                    self.emit_preview(processed_frame, force=current_frame == tracker.total_frames)
+                tracker.estimate_total(source.frames_read, source.position)
+                if not tracker.update(current_frame):
+                    return
+
+                # 更新进度和剩余时间
+                self.report_progress(min(90, int(tracker.fraction * 90)))
+                self.report_eta(tracker)
+
+            try:
+                pipeline.run(source.read, out.write, on_frame, cancel_event=self._cancel_event)
+            finally:
+                self.pipeline_stats = pipeline.stats
+                if pipeline.skipper is not None:
+                    self.skip_ratio = pipeline.skipper.skip_ratio
+                print(pipeline.format_stats())
+
+            if not self.cancelled:
+                # 帧数估计不准时也能准确收尾
+                tracker.finish()
+                self.report_progress(90)
+                self.report_eta(tracker)
+            source.close()
+            source = None
+            if self.cancelled:
+                if isinstance(out, SegmentedWriter):
+                    # 提交当前片段，下次从这里继续
+                    out.close()
+                    out = None
+                raise ProcessingCancelled(f"处理已取消: {self.video_path}")
+
+            if isinstance(out, SegmentedWriter):
+                out.close()
+                self.report_progress(95)
+                audio_path = self.wait_audio(demuxer)
+                with self.metrics.timed('concat'):
+                    concat_segments(checkpoint.segment_paths(), output_path,
+                                    os.path.join(checkpoint.work_dir, 'concat.txt'),
+                                    audio_source=audio_path, audio_copy=True)
+                checkpoint.cleanup()
+            elif isinstance(out, FFmpegWriter):
+                # 音频已在同一个 ffmpeg 进程中写入，等待编码结束即可
+                self.report_progress(95)
+                with self.metrics.timed('encode_finish'):
+                    out.close()
+            else:
+                out.release()
+                self.merge_temp_outputs(output_path, demuxer)
+            out = None
+
+            self.finish(output_path, cache, cache_key)
+
+        except Exception as e:
+            if not isinstance(e, ProcessingCancelled):
+                print(f"处理视频时出错: {str(e)}")
+            if source is not None:
+                source.close()
+            if demuxer is not None:
+                demuxer.cleanup()
+            if isinstance(out, (FFmpegWriter, SegmentedWriter)):
+                out.abort()
+            elif out is not None:
+                out.release()
+            self.cleanup_temp_files()
+            self.write_metrics()
+            raise e
+
+    def merge_temp_outputs(self, output_path, demuxer=None):
+        """把后台提取的音轨与临时视频合并到输出路径"""
+        # 音轨通常在视频处理期间已经提取完成
+        self.report_progress(92)
+        audio_path = self.wait_audio(demuxer)
+
+        # 合并音视频，只复制数据不重新编码
+        self.report_progress(95)
+        if audio_path:
+            with self.metrics.timed('audio_mux'):
+                success = self.merge_audio_video(self.temp_video_path, audio_path, output_path)
+            if not success:
+                shutil.copy2(self.temp_video_path, output_path)
+        else:
+            shutil.copy2(self.temp_video_path, output_path)
+
+        # 清理临时文件
+        self.cleanup_temp_files()
@@ -0,0 +1,53 @@
+import cv2
+
+
+class TemporalSkipper:
+    """时域跳帧：画面与参考帧差异很小时复用参考帧的风格化结果
+
+    差异的计算方式：把缩小后的灰度缩略图分成 grid 个区块，取各区块平均绝对差
+    （0-255）的最大值，这样小范围的运动也能被检测到。差异低于 threshold 时跳过风格化。
+    参考帧只在真正处理时更新，缓慢的平移或渐变会逐帧累积差异，不会一直被跳过；
+    max_reuse 限制连续复用的帧数，保证画面定期刷新。
+    threshold 越大跳过越多、速度越快，但细微的运动可能被冻结。
+    """
+
+    def __init__(self, threshold, max_reuse=30, thumb_size=(64, 36), grid=(16, 9)):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.thumb_size = thumb_size
+        self.grid = grid
+        self.frames = 0
+        self.skipped = 0
+        self._reference = None
+        self._reused = 0
+
+    def _thumbnail(self, frame):
+        # 先缩小再转灰度，避免整帧的颜色转换
+        small = cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def should_reuse(self, frame):
+        """判断该帧是否可以复用上一个风格化结果，需按帧顺序调用"""
+        self.frames += 1
+        thumb = self._thumbnail(frame)
+        if self._reference is not None and self._reused < self.max_reuse:
+            diff = cv2.resize(cv2.absdiff(thumb, self._reference), self.grid,
+                              interpolation=cv2.INTER_AREA)
+            if diff.max() < self.threshold:
+                self._reused += 1
+                self.skipped += 1
+                return True
+        self._reference = thumb
+        self._reused = 0
+        return False
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+
+def make_skipper(options):
+    """按处理选项创建跳帧器，temporal_threshold 为 0 时不启用"""
+    if not options.get('temporal_threshold'):
+        return None
+    return TemporalSkipper(options['temporal_threshold'], options['temporal_max_reuse'])
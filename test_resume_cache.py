@@ -0,0 +1,140 @@
+"""续传、分块复用和结果缓存的回归测试
+
+用 benchmark.make_test_clip 生成的 testsrc2 小片段端到端运行；testsrc2 每帧画面
+不同（带帧计数），解码比较可以同时检查帧数和帧序。需要 ffmpeg，不需要 ffprobe。
+"""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import make_test_clip
+from chunked import ChunkedRenderer, chunk_path
+from ffmpeg_io import ffmpeg_available
+from frame_pipeline import ProcessingCancelled
+from result_cache import ResultCache
+from stylizer import DEFAULT_OPTIONS, VideoStylizer
+
+pytestmark = pytest.mark.skipif(not ffmpeg_available(), reason='需要 ffmpeg')
+
+STYLE = '素描风格'
+PARAMS = {'strength': 50, 'saturation': 0, 'brightness': 0, 'scale_factor': 1.0}
+FRAMES = 30
+
+
+@pytest.fixture
+def clip(tmp_path):
+    return make_test_clip(str(tmp_path / 'source.mp4'), 160, 120, 3, fps=FRAMES // 3, with_audio=False)
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def resumable_stylizer(clip, **options):
+    options = dict({'resumable': True, 'segment_frames': 5, 'decoder': 'opencv',
+                    'num_workers': 1}, **options)
+    return VideoStylizer(clip, STYLE, dict(PARAMS), options)
+
+
+def cancel_after(stylizer, frames):
+    """写出 frames 帧后请求取消；预览不限频，每写出一帧回调一次"""
+    written = []
+
+    def on_preview(frame):
+        written.append(frame)
+        if len(written) == frames:
+            stylizer.cancel()
+
+    stylizer.options['preview_max_fps'] = 0
+    stylizer.on_preview = on_preview
+
+
+def interrupt(clip, output, **options):
+    """处理到大约一半时取消，返回已提交的帧数"""
+    stylizer = resumable_stylizer(clip, **options)
+    cancel_after(stylizer, FRAMES // 2 - 3)
+    with pytest.raises(ProcessingCancelled):
+        stylizer.process_video(output)
+    next_frame = resumable_stylizer(clip, **options).open_checkpoint(output).next_frame
+    assert 0 < next_frame < FRAMES
+    return next_frame
+
+
+def test_cancel_and_resume_keeps_frame_count_and_order(clip, tmp_path):
+    reference = str(tmp_path / 'reference.mp4')
+    resumable_stylizer(clip).process_video(reference)
+
+    output = str(tmp_path / 'output.mp4')
+    interrupt(clip, output)
+    resumable_stylizer(clip).process_video(output)
+
+    expected, actual = read_frames(reference), read_frames(output)
+    assert len(expected) == len(actual) == FRAMES
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        assert np.array_equal(a, b), f'第 {index} 帧不一致'
+    assert not os.path.exists(output + '.work')
+
+
+def test_resume_discards_segments_after_option_change(clip, tmp_path):
+    output = str(tmp_path / 'output.mp4')
+    interrupt(clip, output)
+    assert resumable_stylizer(clip, crf=40).open_checkpoint(output).next_frame == 0
+    assert not [name for name in os.listdir(output + '.work') if name.startswith('segment_')]
+
+
+def test_resume_discards_segments_after_source_change(clip, tmp_path):
+    output = str(tmp_path / 'output.mp4')
+    interrupt(clip, output)
+    stat = os.stat(clip)
+    os.utime(clip, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert resumable_stylizer(clip).open_checkpoint(output).next_frame == 0
+
+
+def test_chunk_reuse_requires_same_fingerprint(clip, tmp_path):
+    chunks = [(0.0, 1.0), (1.0, None)]
+    work_dir = str(tmp_path / 'output.mp4.chunks')
+
+    def prepare(**options):
+        renderer = ChunkedRenderer(clip, STYLE, dict(PARAMS), dict(DEFAULT_OPTIONS, chunks=2, **options))
+        renderer._prepare_work_dir(work_dir, chunks)
+
+    prepare()
+    with open(chunk_path(work_dir, 0), 'wb') as f:
+        f.write(b'chunk')
+    prepare()
+    assert os.path.exists(chunk_path(work_dir, 0))
+
+    prepare(crf=51, tile_size=64)
+    assert not os.path.exists(chunk_path(work_dir, 0))
+
+    with open(chunk_path(work_dir, 0), 'wb') as f:
+        f.write(b'chunk')
+    stat = os.stat(clip)
+    os.utime(clip, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    prepare(crf=51, tile_size=64)
+    assert not os.path.exists(chunk_path(work_dir, 0))
+
+
+def test_cache_entry_with_deleted_file_is_a_miss(clip, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    cache.store('key', clip)
+    assert cache.fetch('key', str(tmp_path / 'hit.mp4'))
+
+    os.remove(os.path.join(cache.cache_dir, 'key.mp4'))
+    assert not cache.fetch('key', str(tmp_path / 'miss.mp4'), link=True)
+    assert not os.path.exists(tmp_path / 'miss.mp4')
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (0, 1, 1)
+
+    cache.store('key', clip)
+    assert cache.fetch('key', str(tmp_path / 'again.mp4'))
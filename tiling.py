@@ -0,0 +1,90 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from frame_ops import compile_pipeline
+
+
+def split_tiles(height, width, tile_size):
+    """把帧均匀切成边长不超过 tile_size 的块，返回 [(y0, y1, x0, x1)]"""
+    rows = math.ceil(height / tile_size)
+    cols = math.ceil(width / tile_size)
+    ys = [height * i // rows for i in range(rows + 1)]
+    xs = [width * i // cols for i in range(cols + 1)]
+    return [(ys[r], ys[r + 1], xs[c], xs[c + 1]) for r in range(rows) for c in range(cols)]
+
+
+class TiledStyler:
+    """分块风格化：把大帧切成带重叠边的块，各块并行处理后拼入预分配的输出
+
+    每个工作线程的中间缓冲区只和块大小有关，与分辨率无关；单个 4K/8K 帧也能
+    用满所有核。重叠宽度和块起点的对齐取自风格引擎的 halo/align；halo 为 0 的
+    风格整帧处理。提供 local/finish 的风格（素描的对比度拉伸需要整帧的最值）
+    分块只做局部部分，剩余步骤在拼接后整帧完成。提供 reduces(height, width) 的风格
+    （卡通）按整帧尺寸决定是否缩小处理，并传给每个块。传入 out 时拼接结果写入 out。
+    """
+
+    def __init__(self, style, params, use_gpu=False, tile_size=1024, num_workers=1):
+        self.style = style
+        self.params = params
+        self.use_gpu = use_gpu
+        self.tile_size = tile_size
+        self.num_workers = max(1, num_workers)
+        self.engine = compile_pipeline(style, params, use_gpu).engine
+        self.halo = self.engine.halo
+        self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def _map(self, func, tiles):
+        if self.num_workers == 1 or len(tiles) == 1:
+            for tile in tiles:
+                func(tile)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        # list() 等待全部块完成，并把块中的异常抛出
+        list(self._executor.map(func, tiles))
+
+    def _padded(self, tile, height, width):
+        y0, y1, x0, x1 = tile
+        align = self.engine.align
+        py0 = max(0, y0 - self.halo) // align * align
+        px0 = max(0, x0 - self.halo) // align * align
+        py1, px1 = min(height, y1 + self.halo), min(width, x1 + self.halo)
+        return (py0, py1, px0, px1), (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+
+    def __call__(self, frame, out=None):
+        height, width = frame.shape[:2]
+        if self.halo == 0 or (height <= self.tile_size and width <= self.tile_size):
+            return self.engine(frame, out)
+        tiles = split_tiles(height, width, self.tile_size)
+
+        if hasattr(self.engine, 'finish'):
+            partial = np.empty((height, width), dtype=np.uint8)
+
+            def local_tile(tile):
+                (py0, py1, px0, px1), core = self._padded(tile, height, width)
+                y0, y1, x0, x1 = tile
+                partial[y0:y1, x0:x1] = self.engine.local(frame[py0:py1, px0:px1])[core]
+
+            self._map(local_tile, tiles)
+            return self.engine.finish(frame, partial, out)
+
+        output = np.empty_like(frame) if out is None else out
+        options = {}
+        if hasattr(self.engine, 'reduces'):
+            options['reduce'] = self.engine.reduces(height, width)
+
+        def style_tile(tile):
+            (py0, py1, px0, px1), core = self._padded(tile, height, width)
+            y0, y1, x0, x1 = tile
+            result = self.engine(frame[py0:py1, px0:px1], **options)
+            output[y0:y1, x0:x1] = result[core]
+
+        self._map(style_tile, tiles)
+        return output